@@ -0,0 +1,168 @@
+from typing import Any, Dict, List, Optional
+
+import psycopg2.extras
+
+# Relation kinds listed as tables: tables, partitioned tables, views,
+# materialized views and foreign tables.
+TABLE_KINDS = ("r", "p", "v", "m", "f")
+
+TABLES_QUERY = """
+    SELECT c.relname AS table_name, obj_description(c.oid, 'pg_class') AS comment
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %(schema)s
+      AND c.relkind IN %(kinds)s
+      AND (pg_has_role(c.relowner, 'USAGE')
+           OR has_table_privilege(c.oid, 'SELECT, INSERT, UPDATE, DELETE, TRUNCATE, REFERENCES, TRIGGER')
+           OR has_any_column_privilege(c.oid, 'SELECT, INSERT, UPDATE, REFERENCES'))
+    ORDER BY c.relname
+"""
+
+# Types, lengths and precisions are reported the way information_schema.columns
+# reports them, so the model is a drop-in replacement for the per-table queries.
+COLUMNS_QUERY = """
+    SELECT c.relname AS table_name,
+           a.attname AS column_name,
+           CASE WHEN t.typtype = 'd' THEN
+                    CASE WHEN bt.typelem <> 0 AND bt.typlen = -1 THEN 'ARRAY'
+                         WHEN nbt.nspname = 'pg_catalog' THEN format_type(t.typbasetype, NULL)
+                         ELSE 'USER-DEFINED' END
+                WHEN t.typelem <> 0 AND t.typlen = -1 THEN 'ARRAY'
+                WHEN nt.nspname = 'pg_catalog' THEN format_type(a.atttypid, NULL)
+                ELSE 'USER-DEFINED' END AS data_type,
+           CASE WHEN a.attnotnull OR (t.typtype = 'd' AND t.typnotnull) THEN 'NO' ELSE 'YES' END AS is_nullable,
+           pg_get_expr(ad.adbin, ad.adrelid) AS column_default,
+           information_schema._pg_char_max_length(information_schema._pg_truetypid(a.*, t.*),
+                                                  information_schema._pg_truetypmod(a.*, t.*)) AS character_maximum_length,
+           information_schema._pg_numeric_precision(information_schema._pg_truetypid(a.*, t.*),
+                                                    information_schema._pg_truetypmod(a.*, t.*)) AS numeric_precision,
+           information_schema._pg_numeric_scale(information_schema._pg_truetypid(a.*, t.*),
+                                                information_schema._pg_truetypmod(a.*, t.*)) AS numeric_scale,
+           col_description(c.oid, a.attnum) AS comment
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_type t ON t.oid = a.atttypid
+    JOIN pg_namespace nt ON nt.oid = t.typnamespace
+    LEFT JOIN (pg_type bt JOIN pg_namespace nbt ON nbt.oid = bt.typnamespace)
+           ON t.typtype = 'd' AND bt.oid = t.typbasetype
+    LEFT JOIN pg_attrdef ad ON ad.adrelid = a.attrelid AND ad.adnum = a.attnum
+    WHERE n.nspname = %(schema)s
+      AND c.relkind IN %(kinds)s
+      AND a.attnum > 0
+      AND NOT a.attisdropped
+    ORDER BY c.relname, a.attnum
+"""
+
+KEYS_QUERY = """
+    SELECT con.contype AS kind,
+           c.relname AS table_name,
+           a.attname AS column_name,
+           fc.relname AS foreign_table_name,
+           fa.attname AS foreign_column_name
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    CROSS JOIN LATERAL unnest(con.conkey, coalesce(con.confkey, con.conkey))
+        WITH ORDINALITY AS k(attnum, foreign_attnum, position)
+    JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+    LEFT JOIN pg_class fc ON fc.oid = con.confrelid
+    LEFT JOIN pg_attribute fa ON fa.attrelid = con.confrelid AND fa.attnum = k.foreign_attnum
+    WHERE n.nspname = %(schema)s AND con.contype IN ('p', 'f')
+    ORDER BY c.relname, con.contype, con.conname, k.position
+"""
+
+
+class Catalog:
+    """
+    In-memory model of one schema's tables, columns and keys.
+
+    Loaded in three pg_catalog queries whatever the number of tables, and
+    indexed by table and column name, so introspection during analysis never
+    goes back to the database. Column entries have the same shape as the
+    rows of information_schema.columns the analyzer used to query per table.
+    """
+
+    def __init__(self, tables: Dict[str, Dict[str, Any]], primary_keys: Dict[str, List[str]],
+                 foreign_keys: List[Dict[str, str]], column_comments: Dict[str, str]):
+        self.tables = tables  # table -> {"columns": [...], "comment": str}
+        self.primary_keys = primary_keys
+        self.foreign_keys = foreign_keys
+        self.column_comments = column_comments  # "table.column" -> comment
+        self.columns = {f"{table}.{column['name']}": column
+                        for table, entry in tables.items() for column in entry["columns"]}
+
+    def table_names(self) -> List[str]:
+        return list(self.tables)
+
+    def table_columns(self, table_name: str) -> List[Dict[str, Any]]:
+        """Copies of a table's column entries, in column order."""
+        entry = self.tables.get(table_name)
+        return [column.copy() for column in entry["columns"]] if entry else []
+
+    def column(self, table_name: str, column_name: str) -> Optional[Dict[str, Any]]:
+        return self.columns.get(f"{table_name}.{column_name}")
+
+    def table_comment(self, table_name: str) -> str:
+        entry = self.tables.get(table_name)
+        return entry["comment"] if entry else ""
+
+    def column_comment(self, table_name: str, column_name: str) -> str:
+        return self.column_comments.get(f"{table_name}.{column_name}", "")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The structure the schema analysis depends on, as plain JSON-able data."""
+        return {
+            "tables": {table: {"columns": self.table_columns(table), "comment": entry["comment"]}
+                       for table, entry in self.tables.items()},
+            "foreign_keys": [dict(fk) for fk in self.foreign_keys],
+            "primary_keys": {table: list(columns) for table, columns in self.primary_keys.items()}
+        }
+
+
+def load_catalog(connection, schema: str = "public") -> Catalog:
+    """Read the tables, columns, comments and keys of a schema in three queries."""
+    params = {"schema": schema, "kinds": TABLE_KINDS}
+    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute(TABLES_QUERY, params)
+        tables = {row["table_name"]: {"columns": [], "comment": row["comment"] or ""}
+                  for row in cursor.fetchall()}
+
+        column_comments = {}
+        cursor.execute(COLUMNS_QUERY, params)
+        for row in cursor.fetchall():
+            if row["table_name"] not in tables:
+                continue
+            tables[row["table_name"]]["columns"].append({
+                "name": row["column_name"],
+                "type": row["data_type"],
+                "nullable": row["is_nullable"],
+                "default": row["column_default"],
+                "max_length": row["character_maximum_length"],
+                "precision": row["numeric_precision"],
+                "scale": row["numeric_scale"]
+            })
+            if row["comment"]:
+                column_comments[f"{row['table_name']}.{row['column_name']}"] = row["comment"]
+
+        primary_keys, foreign_keys = {}, []
+        cursor.execute(KEYS_QUERY, params)
+        for row in cursor.fetchall():
+            if row["kind"] == "p":
+                primary_keys.setdefault(row["table_name"], []).append(row["column_name"])
+            else:
+                foreign_keys.append({
+                    "table": row["table_name"],
+                    "column": row["column_name"],
+                    "foreign_table": row["foreign_table_name"],
+                    "foreign_column": row["foreign_column_name"]
+                })
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return Catalog(tables, primary_keys, foreign_keys, column_comments)
@@ -1,11 +1,16 @@
 import psycopg2
 import psycopg2.extras
+from psycopg2 import sql
+from contextlib import contextmanager
 from typing import List, Dict, Any, Tuple, Optional
 import asyncio
 import streamlit as st
 
+from catalog import Catalog, load_catalog
+from db_pool import get_pool, may_change_session
 from llm_semantic_analyzer import LLMSemanticAnalyzer
-from utils import infer_column_semantics_heuristic
+from schema_cache import SchemaCache, catalog_fingerprint, diff_catalogs
+from utils import InferenceProgress, infer_column_semantics_heuristic
 
 class DatabaseAnalyzer:
     """Class to analyze PostgreSQL database schema and execute queries with LLM-enhanced semantics."""
@@ -20,9 +25,14 @@ class DatabaseAnalyzer:
             "host": host,
             "port": port
         }
-        self.connection = None
+        self.pool = None  # Process-wide connection pool shared with other sessions
         self.schema_info = {}
         self.column_semantics = {}  # Store inferred meanings of column names
+        self.schema_cache = SchemaCache()
+        self.inference_errors = 0  # LLM failures papered over by heuristics in the current analysis
+        self.catalog = None  # Tables, columns and keys read from pg_catalog
+        self.analyzed_catalog = None  # Catalog snapshot the current LLM analysis was made from
+        self.last_changes = None  # What the last incremental analysis re-analyzed
 
         # Initialize the semantic analyzer
         self.semantic_analyzer = LLMSemanticAnalyzer(
@@ -31,203 +41,139 @@ class DatabaseAnalyzer:
         )
 
     def connect(self) -> Tuple[bool, str]:
-        """Establish connection to the database."""
+        """Attach to the shared connection pool for this database and check that it can connect."""
         try:
-            self.connection = psycopg2.connect(**self.connection_params)
+            pool = get_pool(self.connection_params)
+            with pool.connection():
+                pass
+            self.pool = pool
             return True, "Connected to PostgreSQL database successfully!"
         except Exception as e:
             return False, f"Error connecting to PostgreSQL database: {e}"
 
     def close(self) -> str:
-        """Close the database connection."""
-        if self.connection:
-            self.connection.close()
+        """Detach from the connection pool; its connections stay open for other sessions."""
+        if self.pool:
+            self.pool = None
             return "Database connection closed."
 
+    @contextmanager
+    def checkout(self, reset: bool = False):
+        """
+        Borrow a pooled connection for one unit of work. Pass reset when the
+        work may change session state, so it is discarded before the
+        connection serves another session.
+        """
+        if not self.pool:
+            success, message = self.connect()
+            if not success:
+                raise Exception(message)
+        with self.pool.connection(reset) as connection:
+            yield connection
+
+    def load_catalog(self, refresh: bool = False) -> Catalog:
+        """
+        Read the tables, columns, comments and keys of the public schema in a
+        few pg_catalog queries, and keep them for the lookups below.
+        """
+        if self.catalog is None or refresh:
+            with self.checkout() as connection:
+                self.catalog = load_catalog(connection)
+        return self.catalog
+
     def get_tables(self) -> List[str]:
         """Get all table names in the database."""
-        if not self.connection:
-            self.connect()
-
-        cursor = self.connection.cursor()
-        cursor.execute("""
-            SELECT table_name
-            FROM information_schema.tables
-            WHERE table_schema = 'public'
-            ORDER BY table_name
-        """)
-        tables = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-        return tables
+        return self.load_catalog().table_names()
 
     def get_table_columns(self, table_name: str) -> List[Dict[str, str]]:
         """Get column details for a specific table."""
-        if not self.connection:
-            self.connect()
-
-        cursor = self.connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("""
-            SELECT column_name, data_type, is_nullable, column_default,
-                   character_maximum_length, numeric_precision, numeric_scale
-            FROM information_schema.columns
-            WHERE table_schema = 'public' AND table_name = %s
-            ORDER BY ordinal_position
-        """, (table_name,))
-
-        columns = []
-        for row in cursor.fetchall():
-            columns.append({
-                "name": row["column_name"],
-                "type": row["data_type"],
-                "nullable": row["is_nullable"],
-                "default": row["column_default"],
-                "max_length": row["character_maximum_length"],
-                "precision": row["numeric_precision"],
-                "scale": row["numeric_scale"]
-            })
-
-        cursor.close()
-        return columns
+        return self.load_catalog().table_columns(table_name)
 
     def get_foreign_keys(self) -> List[Dict[str, str]]:
         """Get all foreign key relationships in the database."""
-        if not self.connection:
-            self.connect()
-
-        cursor = self.connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("""
-            SELECT
-                tc.table_name AS table_name,
-                kcu.column_name AS column_name,
-                ccu.table_name AS foreign_table_name,
-                ccu.column_name AS foreign_column_name
-            FROM
-                information_schema.table_constraints AS tc
-                JOIN information_schema.key_column_usage AS kcu
-                    ON tc.constraint_name = kcu.constraint_name
-                JOIN information_schema.constraint_column_usage AS ccu
-                    ON ccu.constraint_name = tc.constraint_name
-            WHERE tc.constraint_type = 'FOREIGN KEY'
-        """)
-
-        foreign_keys = []
-        for row in cursor.fetchall():
-            foreign_keys.append({
-                "table": row["table_name"],
-                "column": row["column_name"],
-                "foreign_table": row["foreign_table_name"],
-                "foreign_column": row["foreign_column_name"]
-            })
-
-        cursor.close()
-        return foreign_keys
+        return [dict(fk) for fk in self.load_catalog().foreign_keys]
 
     def get_primary_keys(self) -> Dict[str, List[str]]:
         """Get primary key columns for each table."""
-        if not self.connection:
-            self.connect()
-
-        cursor = self.connection.cursor()
-        cursor.execute("""
-            SELECT
-                tc.table_name,
-                kcu.column_name
-            FROM
-                information_schema.table_constraints tc
-                JOIN information_schema.key_column_usage kcu
-                    ON tc.constraint_name = kcu.constraint_name
-            WHERE
-                tc.constraint_type = 'PRIMARY KEY'
-                AND tc.table_schema = 'public'
-            ORDER BY tc.table_name, kcu.ordinal_position
-        """)
-
-        primary_keys = {}
-        for table_name, column_name in cursor.fetchall():
-            if table_name not in primary_keys:
-                primary_keys[table_name] = []
-            primary_keys[table_name].append(column_name)
-
-        cursor.close()
-        return primary_keys
+        return {table: list(columns) for table, columns in self.load_catalog().primary_keys.items()}
+
+    def catalog_snapshot(self) -> Dict[str, Any]:
+        """
+        Describe the structure of the public schema as it is now: every table
+        with its comment and columns, plus primary and foreign keys. The
+        snapshot is what the analysis depends on, so its fingerprint keys the
+        schema cache.
+        """
+        return self.load_catalog(refresh=True).snapshot()
 
     def get_comment_for_column(self, table_name: str, column_name: str) -> str:
         """Get the comment (if any) for a specific column."""
-        if not self.connection:
-            self.connect()
-
-        cursor = self.connection.cursor()
-        cursor.execute("""
-            SELECT pg_description.description
-            FROM pg_description
-            JOIN pg_class ON pg_description.objoid = pg_class.oid
-            JOIN pg_attribute ON pg_attribute.attrelid = pg_class.oid
-                             AND pg_description.objsubid = pg_attribute.attnum
-            WHERE pg_class.relname = %s AND pg_attribute.attname = %s
-        """, (table_name, column_name))
-
-        result = cursor.fetchone()
-        cursor.close()
-
-        return result[0] if result and result[0] else ""
+        return self.load_catalog().column_comment(table_name, column_name)
 
     def get_comment_for_table(self, table_name: str) -> str:
         """Get the comment (if any) for a specific table."""
-        if not self.connection:
-            self.connect()
-
-        cursor = self.connection.cursor()
-        cursor.execute("""
-            SELECT pg_description.description
-            FROM pg_description
-            JOIN pg_class ON pg_description.objoid = pg_class.oid
-            WHERE pg_class.relname = %s AND pg_description.objsubid = 0
-        """, (table_name,))
-
-        result = cursor.fetchone()
-        cursor.close()
-
-        return result[0] if result and result[0] else ""
+        return self.load_catalog().table_comment(table_name)
+
+    def get_sample_values(self, table_name: str, column_names: List[str], limit: int = 5) -> Dict[str, List[Any]]:
+        """Get distinct sample values for several columns of a table in a single query."""
+        if not column_names:
+            return {}
+
+        table = sql.Identifier(table_name)
+        query = sql.SQL("SELECT {}").format(sql.SQL(", ").join(
+            sql.SQL("ARRAY(SELECT DISTINCT {column}::text FROM {table} WHERE {column} IS NOT NULL LIMIT {limit})").format(
+                column=sql.Identifier(column_name), table=table, limit=sql.Literal(limit))
+            for column_name in column_names
+        ))
+        with self.checkout() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query)
+                row = cursor.fetchone()
+                connection.commit()
+                return dict(zip(column_names, row))
+            except Exception as e:
+                connection.rollback()
+                print(f"Error getting sample values for {table_name}: {e}")
+                return {}
+            finally:
+                cursor.close()
 
     def get_sample_data_for_column(self, table_name: str, column_name: str, limit: int = 5) -> List[Any]:
         """Get distinct sample values for a specific column."""
-        if not self.connection:
-            self.connect()
-
-        cursor = self.connection.cursor()
-        try:
-            # Use DISTINCT to get unique values and limit results
-            cursor.execute(f"SELECT DISTINCT {column_name} FROM {table_name} WHERE {column_name} IS NOT NULL LIMIT {limit}")
-            return [row[0] for row in cursor.fetchall()]
-        except Exception as e:
-            print(f"Error getting sample data for column: {e}")
-            return []
-        finally:
-            cursor.close()
+        with self.checkout() as connection:
+            cursor = connection.cursor()
+            try:
+                # Use DISTINCT to get unique values and limit results
+                cursor.execute(f"SELECT DISTINCT {column_name} FROM {table_name} WHERE {column_name} IS NOT NULL LIMIT {limit}")
+                return [row[0] for row in cursor.fetchall()]
+            except Exception as e:
+                print(f"Error getting sample data for column: {e}")
+                return []
+            finally:
+                cursor.close()
 
     def get_sample_data(self, table_name: str, limit: int = 3) -> List[Dict[str, Any]]:
         """Get sample data from a table."""
-        if not self.connection:
-            self.connect()
-
-        cursor = self.connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        try:
-            cursor.execute(f"SELECT * FROM {table_name} LIMIT {limit}")
-            columns = [desc[0] for desc in cursor.description]
+        with self.checkout() as connection:
+            cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            try:
+                cursor.execute(f"SELECT * FROM {table_name} LIMIT {limit}")
+                columns = [desc[0] for desc in cursor.description]
 
-            results = []
-            for row in cursor.fetchall():
-                result_dict = {}
-                for i, column in enumerate(columns):
-                    result_dict[column] = row[i]
-                results.append(result_dict)
+                results = []
+                for row in cursor.fetchall():
+                    result_dict = {}
+                    for i, column in enumerate(columns):
+                        result_dict[column] = row[i]
+                    results.append(result_dict)
 
-            return results
-        except Exception as e:
-            print(f"Error getting sample data: {e}")
-            return []
-        finally:
-            cursor.close()
+                return results
+            except Exception as e:
+                print(f"Error getting sample data: {e}")
+                return []
+            finally:
+                cursor.close()
 
     def get_column_semantics(self, table_name: str, column_name: str) -> str:
         """
@@ -247,19 +193,9 @@ class DatabaseAnalyzer:
             return comment
 
         # Get column type and sample values
-        cursor = self.connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("""
-            SELECT data_type
-            FROM information_schema.columns
-            WHERE table_schema = 'public'
-            AND table_name = %s
-            AND column_name = %s
-        """, (table_name, column_name))
-
-        result = cursor.fetchone()
-        data_type = result['data_type'] if result else 'unknown'
-
-        # Get sample values
+        column = self.load_catalog().column(table_name, column_name)
+        data_type = column['type'] if column else 'unknown'
+
         sample_values = self.get_sample_data_for_column(table_name, column_name)
 
         # Get other columns in the table for context
@@ -268,8 +204,6 @@ class DatabaseAnalyzer:
         # Get foreign key relationships
         foreign_keys = self.get_foreign_keys()
 
-        cursor.close()
-
         # Use LLM to infer semantics with enhanced context
         try:
             semantics = self.semantic_analyzer.infer_column_semantics(
@@ -289,86 +223,140 @@ class DatabaseAnalyzer:
             self.column_semantics[column_key] = semantics
             return semantics
 
-    async def analyze_column_semantics_async(self, batch_size: int = 10) -> Dict[str, str]:
+    async def analyze_column_semantics_async(self, batch_size: int = 10,
+                                             sample_rows: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                                             progress: Optional[InferenceProgress] = None) -> Dict[str, str]:
         """
         Analyze all columns in the database to infer their semantics using the LLM.
         Uses batching to reduce the number of LLM API calls.
 
         Args:
             batch_size: Number of columns to process in a single LLM call
+            sample_rows: Sample rows per table already read by the caller
+            progress: Progress display shared with the caller's other requests
 
         Returns:
             Dictionary mapping column keys (table.column) to their semantic descriptions
         """
-        if not self.connection:
-            self.connect()
-
         # Get all tables
         tables = self.get_tables()
         foreign_keys = self.get_foreign_keys()
 
         # Collect all columns with their types and sample values
         all_columns = []
+        for table in tables:
+            columns = self.get_table_columns(table)
+            if sample_rows is not None:
+                sample_data = sample_rows.get(table, [])
+            else:
+                sample_data = self.get_sample_data(table, limit=3)
+
+            for column in columns:
+                all_columns.append(self._column_info(table, column, sample_data))
 
         # Show progress info if running in Streamlit
-        progress_placeholder = None
-        if 'st' in globals():
-            progress_placeholder = st.empty()
+        own_progress = progress is None
+        if own_progress:
+            progress = InferenceProgress(st.empty() if 'st' in globals() else None)
 
-        for i, table in enumerate(tables):
-            if progress_placeholder:
-                progress_placeholder.text(f"Analyzing table {i+1} of {len(tables)}: {table}")
+        semantics = await self.infer_columns_async(all_columns, foreign_keys, batch_size, progress)
 
-            columns = self.get_table_columns(table)
-            sample_data = self.get_sample_data(table, limit=3)
+        if own_progress:
+            progress.clear()
 
-            for column in columns:
-                column_info = {
-                    'table_name': table,
-                    'column_name': column['name'],
-                    'data_type': column['type'],
-                    'sample_values': []
-                }
+        self.column_semantics = semantics
+        return semantics
 
-                # Add sample values if available
-                if sample_data:
-                    for row in sample_data:
-                        if column['name'] in row and row[column['name']] is not None:
-                            column_info['sample_values'].append(row[column['name']])
+    @staticmethod
+    def _column_info(table: str, column: Dict[str, Any], sample_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Describe one column for batch semantic inference."""
+        column_info = {
+            'table_name': table,
+            'column_name': column['name'],
+            'data_type': column['type'],
+            'sample_values': []
+        }
 
-                all_columns.append(column_info)
+        # Add sample values if available
+        if sample_data:
+            for row in sample_data:
+                if column['name'] in row and row[column['name']] is not None:
+                    column_info['sample_values'].append(row[column['name']])
 
-        # Process columns in batches with enhanced context
-        semantics = {}
-        batch_count = (len(all_columns) + batch_size - 1) // batch_size  # Ceiling division
+        return column_info
 
-        for i in range(0, len(all_columns), batch_size):
-            if progress_placeholder:
-                progress_placeholder.text(f"Processing batch {i//batch_size + 1} of {batch_count} ({len(all_columns)} columns total)")
+    async def infer_columns_async(self, all_columns: List[Dict[str, Any]], foreign_keys: List[Dict[str, str]],
+                                  batch_size: int = 10, progress: Optional[InferenceProgress] = None) -> Dict[str, str]:
+        """
+        Infer the semantics of the given columns in batches, falling back to
+        heuristics for any batch the LLM fails on.
 
-            batch = all_columns[i:i+batch_size]
+        Each batch holds columns of a single table, so it is exactly one LLM
+        request, and all batches are sent at once: the semantic analyzer lets
+        as many run as the server has slots.
+        """
+        columns_by_table = {}
+        for col_info in all_columns:
+            columns_by_table.setdefault(col_info['table_name'], []).append(col_info)
+        batches = [table_columns[i:i+batch_size]
+                   for table_columns in columns_by_table.values()
+                   for i in range(0, len(table_columns), batch_size)]
+        if progress:
+            progress.expect(len(batches))
+
+        async def infer(batch):
             try:
-                batch_results = await self.semantic_analyzer.batch_infer_column_semantics_async(batch, foreign_keys)
-                semantics.update(batch_results)
+                return await self.semantic_analyzer.batch_infer_column_semantics_async(batch, foreign_keys)
             except Exception as e:
                 print(f"Error processing batch: {e}")
+                self.inference_errors += 1
                 # Fallback to heuristic approach for failed batch
-                for col_info in batch:
-                    col_key = f"{col_info['table_name']}.{col_info['column_name']}"
-                    semantics[col_key] = infer_column_semantics_heuristic(
+                return {
+                    f"{col_info['table_name']}.{col_info['column_name']}": infer_column_semantics_heuristic(
                         col_info['table_name'],
                         col_info['column_name'],
                         col_info['data_type']
                     )
+                    for col_info in batch
+                }
+            finally:
+                if progress:
+                    progress.finish(f"{len(batch)} columns of {batch[0]['table_name']}")
 
-            # Add a small delay to avoid overwhelming the LLM service
-            await asyncio.sleep(0.5)
+        semantics = {}
+        for batch_results in await asyncio.gather(*(infer(batch) for batch in batches)):
+            semantics.update(batch_results)
+        return semantics
 
-        if progress_placeholder:
-            progress_placeholder.empty()
+    async def infer_table_comments_async(self, tables: Dict[str, Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]],
+                                         progress: Optional[InferenceProgress] = None) -> Dict[str, str]:
+        """
+        Describe tables that have no comment with the LLM, all requests at once.
 
-        self.column_semantics = semantics
-        return semantics
+        Args:
+            tables: Table name to (columns, sample rows) for each table to describe
+            progress: Optional progress display
+
+        Returns:
+            Dictionary mapping table names to descriptions ("" where the LLM failed)
+        """
+        if progress:
+            progress.expect(len(tables))
+
+        async def infer(table, columns, sample_data):
+            try:
+                return await self.semantic_analyzer.infer_table_semantics_async(table, columns, sample_data)
+            except Exception as e:
+                print(f"Error generating table semantics for {table}: {e}")
+                self.inference_errors += 1
+                return ""
+            finally:
+                if progress:
+                    progress.finish(f"table {table}")
+
+        comments = await asyncio.gather(*(infer(table, columns, sample_data)
+                                          for table, (columns, sample_data) in tables.items()))
+        return dict(zip(tables, comments))
 
     def analyze_column_semantics(self, batch_size: int = 10) -> Dict[str, str]:
         """Synchronous wrapper for analyze_column_semantics_async."""
@@ -379,69 +367,57 @@ class DatabaseAnalyzer:
         Analyze a specific table using LLM for enhanced semantics.
         Useful for focused analysis of important tables.
         """
-        if not self.connection:
-            self.connect()
-
         # Get table details
         columns = self.get_table_columns(table_name)
         table_comment = self.get_comment_for_table(table_name)
         sample_data = self.get_sample_data(table_name)
         foreign_keys = self.get_foreign_keys()
 
-        # If no existing table comment, generate one with LLM
-        if not table_comment:
-            try:
-                table_comment = await self.semantic_analyzer.infer_table_semantics_async(
-                    table_name, columns, sample_data
-                )
-            except Exception as e:
-                print(f"Error generating table semantics: {e}")
-                table_comment = ""
-
-        # Process columns with enhanced LLM analysis
-        processed_columns = []
-
-        # Process columns in smaller batches to avoid overwhelming LLM service
-        batch_size = 5
-        for i in range(0, len(columns), batch_size):
-            batch = columns[i:i+batch_size]
+        # Sample values for every column in one query
+        sample_values = self.get_sample_values(table_name, [column['name'] for column in columns])
 
-            # Create tasks for parallel processing
-            tasks = []
-            for column in batch:
-                # Get sample values for this column
-                sample_values = self.get_sample_data_for_column(table_name, column['name'])
+        self.inference_errors = 0
+        progress = InferenceProgress(st.empty() if 'st' in globals() else None)
+        progress.expect(len(columns))
 
-                # Create task to get semantics
-                task = self.semantic_analyzer.infer_column_semantics_async(
+        async def infer(column):
+            try:
+                return await self.semantic_analyzer.infer_column_semantics_async(
                     table_name,
                     column['name'],
                     column['type'],
-                    sample_values,
+                    sample_values.get(column['name'], []),
                     columns,  # Pass all columns for context
                     foreign_keys  # Pass foreign keys for relationship context
                 )
-                tasks.append((column, task))
-
-            # Execute all tasks and wait for results
-            for column, task in tasks:
-                try:
-                    semantics = await task
-                    column_with_semantics = column.copy()
+            except Exception as e:
+                print(f"Error processing column {column['name']}: {e}")
+                self.inference_errors += 1
+                return ""
+            finally:
+                progress.finish(f"{table_name}.{column['name']}")
+
+        # Describe the table (if it has no comment) and every column concurrently;
+        # the semantic analyzer bounds how many requests run at once.
+        missing_comment = {} if table_comment else {table_name: (columns, sample_data)}
+        comments, column_results = await asyncio.gather(
+            self.infer_table_comments_async(missing_comment, progress),
+            asyncio.gather(*(infer(column) for column in columns))
+        )
+        table_comment = table_comment or comments.get(table_name, "")
+        progress.clear()
 
-                    if semantics:
-                        column_with_semantics["semantics"] = semantics
-                        # Update global semantics dict
-                        self.column_semantics[f"{table_name}.{column['name']}"] = semantics
+        # Process columns with enhanced LLM analysis
+        processed_columns = []
+        for column, semantics in zip(columns, column_results):
+            column_with_semantics = column.copy()
 
-                    processed_columns.append(column_with_semantics)
-                except Exception as e:
-                    print(f"Error processing column {column['name']}: {e}")
-                    # Add column without semantics on error
-                    processed_columns.append(column.copy())
+            if semantics:
+                column_with_semantics["semantics"] = semantics
+                # Update global semantics dict
+                self.column_semantics[f"{table_name}.{column['name']}"] = semantics
 
-            # Small delay between batches
-            await asyncio.sleep(0.5)
+            processed_columns.append(column_with_semantics)
 
         # Return the enhanced table info
         return {
@@ -454,11 +430,182 @@ class DatabaseAnalyzer:
         """Synchronous wrapper for analyze_table_with_llm_async."""
         return asyncio.run(self.analyze_table_with_llm_async(table_name))
 
-    async def analyze_schema_with_llm_async(self) -> Dict[str, Any]:
+    def _database_key(self) -> str:
+        return "{host}:{port}/{dbname}".format(**self.connection_params)
+
+    def _refresh_sample_data(self, schema_info: Dict[str, Any], tables: List[str]):
+        """Re-read sample rows for the given tables."""
+        for table in tables:
+            sample_data = self.get_sample_data(table)
+            if sample_data:
+                schema_info["sample_data"][table] = sample_data
+            else:
+                schema_info["sample_data"].pop(table, None)
+
+    def _columns_with_semantics(self, table: str, columns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Attach the inferred semantics to each column of a table."""
+        processed_columns = []
+        for column in columns:
+            column_with_semantics = column.copy()
+            semantics = self.column_semantics.get(f"{table}.{column['name']}", "")
+            if semantics:
+                column_with_semantics["semantics"] = semantics
+            processed_columns.append(column_with_semantics)
+        return processed_columns
+
+    def _relationships(self, foreign_keys: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Describe foreign keys as relationships, with semantics where known."""
+        relationships = []
+        for fk in foreign_keys:
+            relationship = {
+                "table": fk["table"],
+                "column": fk["column"],
+                "references_table": fk["foreign_table"],
+                "references_column": fk["foreign_column"]
+            }
+
+            # Add semantics for the relationship
+            fk_semantic = self.column_semantics.get(f"{fk['table']}.{fk['column']}", "")
+            pk_semantic = self.column_semantics.get(f"{fk['foreign_table']}.{fk['foreign_column']}", "")
+
+            if fk_semantic or pk_semantic:
+                relationship["semantics"] = f"Connects {fk_semantic or fk['table']} to {pk_semantic or fk['foreign_table']}"
+
+            relationships.append(relationship)
+        return relationships
+
+    def load_cached_schema(self, fingerprint: str, snapshot: Dict[str, Any]) -> bool:
+        """Restore a previous analysis of a schema with this fingerprint, if one was stored."""
+        with self.checkout() as connection:
+            cached = self.schema_cache.load(fingerprint, connection)
+        if not cached:
+            return False
+
+        schema_info = cached["schema_info"]
+        schema_info["sample_data"] = {}
+        self._refresh_sample_data(schema_info, list(schema_info["tables"]))
+
+        self.schema_info = schema_info
+        self.column_semantics = schema_info["column_semantics"]
+        self.analyzed_catalog = snapshot
+        self.last_changes = None
+        return True
+
+    def save_schema_to_cache(self, fingerprint: str):
+        """Persist the current analysis under the catalog fingerprint it was made for."""
+        schema_info = {key: value for key, value in self.schema_info.items() if key != "sample_data"}
+        with self.checkout() as connection:
+            self.schema_cache.save(fingerprint, {"schema_info": schema_info, "catalog": self.analyzed_catalog},
+                                   connection, self._database_key())
+
+    def previous_analysis(self) -> Optional[Dict[str, Any]]:
+        """The last LLM analysis of this database with the catalog it was made from, if any."""
+        if self.analyzed_catalog and self.schema_info:
+            return {"schema_info": self.schema_info, "catalog": self.analyzed_catalog}
+        with self.checkout() as connection:
+            previous = self.schema_cache.load_latest(self._database_key(), connection)
+        if previous and "catalog" in previous:
+            previous["schema_info"]["sample_data"] = {}
+            return previous
+        return None
+
+    async def reanalyze_schema_async(self, previous: Dict[str, Any], snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Bring a previous analysis up to date with the current catalog.
+
+        Only added columns and columns whose type or foreign keys changed are
+        sent to the LLM, and only tables that are new or have no comment get a
+        new description. Everything else is carried over from the previous
+        schema_info, so the cost follows the size of the change.
+        """
+        changes = diff_catalogs(previous["catalog"], snapshot)
+        old_info = previous["schema_info"]
+        old_tables = previous["catalog"]["tables"]
+        foreign_keys = snapshot["foreign_keys"]
+        self.inference_errors = 0
+
+        # Forget semantics of dropped tables and columns
+        dropped = {f"{table}.{column['name']}" for table in changes["removed_tables"]
+                   for column in old_tables[table]["columns"]}
+        dropped.update(f"{table}.{name}" for table, columns in changes["columns"].items()
+                       for name in columns["removed"])
+        self.column_semantics = {key: value for key, value in old_info["column_semantics"].items()
+                                 if key not in dropped}
+
+        schema_info = {
+            "tables": {},
+            "relationships": [],
+            "primary_keys": snapshot["primary_keys"],
+            "sample_data": {table: rows for table, rows in old_info.get("sample_data", {}).items()
+                            if table in snapshot["tables"]},
+            "column_semantics": {}
+        }
+        self._refresh_sample_data(schema_info, [table for table in snapshot["tables"]
+                                                if table in changes["changed_tables"]
+                                                or table not in schema_info["sample_data"]])
+
+        # Re-infer only added and altered columns
+        stale_columns = []
+        for table, columns in changes["columns"].items():
+            names = set(columns["added"] + columns["altered"])
+            stale_columns.extend(self._column_info(table, column, schema_info["sample_data"].get(table, []))
+                                 for column in snapshot["tables"][table]["columns"] if column["name"] in names)
+
+        # A database comment wins; an earlier inferred comment is kept
+        # unless the database comment it stood in for was removed.
+        table_comments = {}
+        for table, entry in snapshot["tables"].items():
+            table_comment = entry["comment"]
+            if not table_comment and not old_tables.get(table, {}).get("comment"):
+                table_comment = old_info["tables"].get(table, {}).get("comment", "")
+            table_comments[table] = table_comment
+        missing_comments = {table: (snapshot["tables"][table]["columns"], schema_info["sample_data"].get(table, []))
+                            for table, comment in table_comments.items() if not comment}
+
+        progress = InferenceProgress(st.empty() if 'st' in globals() else None)
+        column_semantics, inferred_comments = await asyncio.gather(
+            self.infer_columns_async(stale_columns, foreign_keys, progress=progress),
+            self.infer_table_comments_async(missing_comments, progress)
+        )
+        progress.clear()
+        self.column_semantics.update(column_semantics)
+        table_comments.update(inferred_comments)
+
+        schema_info["column_semantics"] = self.column_semantics
+        schema_info["relationships"] = self._relationships(foreign_keys)
+        for table, entry in snapshot["tables"].items():
+            schema_info["tables"][table] = {
+                "columns": self._columns_with_semantics(table, entry["columns"]),
+                "comment": table_comments[table]
+            }
+
+        self.schema_info = schema_info
+        self.analyzed_catalog = snapshot
+        self.last_changes = changes
+        return schema_info
+
+    async def analyze_schema_with_llm_async(self, refresh: bool = False) -> Dict[str, Any]:
         """
         Analyze the complete database schema using LLM for enhanced semantics.
         Processes tables and columns in batches with progress tracking.
+
+        A schema whose catalog fingerprint was analyzed before is loaded from
+        the schema cache instead, and a schema that changed since its last
+        analysis only has the changes re-analyzed, unless refresh is set.
         """
+        snapshot = self.catalog_snapshot()
+        fingerprint = catalog_fingerprint(snapshot)
+        if not refresh:
+            if self.load_cached_schema(fingerprint, snapshot):
+                return self.schema_info
+            previous = self.previous_analysis()
+            if previous:
+                schema_info = await self.reanalyze_schema_async(previous, snapshot)
+                if not self.inference_errors:
+                    self.save_schema_to_cache(fingerprint)
+                return schema_info
+        self.inference_errors = 0
+
         tables = self.get_tables()
         foreign_keys = self.get_foreign_keys()
         primary_keys = self.get_primary_keys()
@@ -472,50 +619,30 @@ class DatabaseAnalyzer:
         }
 
         # Show progress if running in Streamlit
-        progress_placeholder = None
-        progress_bar = None
+        progress = InferenceProgress()
         if 'st' in globals():
-            progress_placeholder = st.empty()
-            progress_bar = st.progress(0.0)
-
-        # First, batch analyze all column semantics
-        self.column_semantics = await self.analyze_column_semantics_async(batch_size=10)
+            progress = InferenceProgress(st.empty(), st.progress(0.0))
+
+        # Read sample rows once; they feed column and table inference and the schema description
+        self._refresh_sample_data(schema_info, tables)
+
+        # Infer all column semantics and the descriptions of uncommented tables concurrently
+        missing_comments = {table: (self.get_table_columns(table), schema_info["sample_data"].get(table, []))
+                            for table in tables if not self.get_comment_for_table(table)}
+        self.column_semantics, table_comments = await asyncio.gather(
+            self.analyze_column_semantics_async(batch_size=10, sample_rows=schema_info["sample_data"],
+                                                progress=progress),
+            self.infer_table_comments_async(missing_comments, progress)
+        )
         schema_info["column_semantics"] = self.column_semantics
 
         # Process each table
-        for i, table in enumerate(tables):
-            if progress_placeholder:
-                progress_placeholder.text(f"Processing table {i+1}/{len(tables)}: {table}")
-                progress_bar.progress((i+1)/len(tables))
-
-            # Get table details
+        for table in tables:
             columns = self.get_table_columns(table)
-            table_comment = self.get_comment_for_table(table)
-
-            # If no existing comment, generate with LLM
-            if not table_comment:
-                try:
-                    sample_data = self.get_sample_data(table)
-                    table_comment = await self.semantic_analyzer.infer_table_semantics_async(
-                        table, columns, sample_data
-                    )
-                except Exception as e:
-                    print(f"Error generating table semantics for {table}: {e}")
-                    table_comment = ""
+            table_comment = self.get_comment_for_table(table) or table_comments.get(table, "")
 
             # Process columns with semantics already analyzed in batch
-            processed_columns = []
-            for column in columns:
-                column_with_semantics = column.copy()
-                semantics = self.column_semantics.get(f"{table}.{column['name']}", "")
-                if semantics:
-                    column_with_semantics["semantics"] = semantics
-                processed_columns.append(column_with_semantics)
-
-            # Get sample data
-            sample_data = self.get_sample_data(table)
-            if sample_data:
-                schema_info["sample_data"][table] = sample_data
+            processed_columns = self._columns_with_semantics(table, columns)
 
             # Store table with its columns and comments
             schema_info["tables"][table] = {
@@ -524,44 +651,31 @@ class DatabaseAnalyzer:
             }
 
         # Add relationship information with enhanced semantics
-        for fk in foreign_keys:
-            relationship = {
-                "table": fk["table"],
-                "column": fk["column"],
-                "references_table": fk["foreign_table"],
-                "references_column": fk["foreign_column"]
-            }
-
-            # Add semantics for the relationship
-            fk_semantic = self.column_semantics.get(f"{fk['table']}.{fk['column']}", "")
-            pk_semantic = self.column_semantics.get(f"{fk['foreign_table']}.{fk['foreign_column']}", "")
-
-            if fk_semantic or pk_semantic:
-                relationship["semantics"] = f"Connects {fk_semantic or fk['table']} to {pk_semantic or fk['references_table']}"
-
-            schema_info["relationships"].append(relationship)
+        schema_info["relationships"] = self._relationships(foreign_keys)
 
         # Clear progress indicators
-        if progress_placeholder:
-            progress_placeholder.empty()
-        if progress_bar:
-            progress_bar.empty()
+        progress.clear()
 
         self.schema_info = schema_info
+        self.analyzed_catalog = snapshot
+        self.last_changes = None
+        # Only a complete LLM analysis is worth keeping; heuristic gaps are retried next time.
+        if not self.inference_errors:
+            self.save_schema_to_cache(fingerprint)
         return schema_info
 
-    def analyze_schema_with_llm(self) -> Dict[str, Any]:
+    def analyze_schema_with_llm(self, refresh: bool = False) -> Dict[str, Any]:
         """Synchronous wrapper for analyze_schema_with_llm_async."""
-        return asyncio.run(self.analyze_schema_with_llm_async())
+        return asyncio.run(self.analyze_schema_with_llm_async(refresh))
 
-    def analyze_schema(self) -> Dict[str, Any]:
+    def analyze_schema(self, refresh: bool = False) -> Dict[str, Any]:
         """
         Analyze the database schema.
         If LLM is available, use LLM-enhanced analysis, otherwise use heuristic approach.
         """
         try:
             # Try with LLM-enhanced analysis first
-            return self.analyze_schema_with_llm()
+            return self.analyze_schema_with_llm(refresh)
         except Exception as e:
             print(f"LLM-enhanced schema analysis failed: {e}")
             print("Falling back to heuristic approach...")
@@ -627,6 +741,7 @@ class DatabaseAnalyzer:
 
         self.schema_info = schema_info
         self.column_semantics = schema_info["column_semantics"]
+        self.analyzed_catalog = None
         return schema_info
 
     def generate_schema_description(self) -> str:
@@ -843,72 +958,54 @@ When generating SQL queries:
         return schema_text
 
     def execute_query(self, query: str) -> Tuple[List[Dict[str, Any]], List[str]]:
-        """Execute an SQL query and return the results as a list of dictionaries."""
-        if not self.connection:
-            self.connect()
-
-        # Check if the current connection is in an aborted transaction state
-        # If so, rollback and reconnect to get a fresh connection
-        try:
-            check_cursor = self.connection.cursor()
-            check_cursor.execute("SELECT 1")
-            check_cursor.close()
-        except psycopg2.errors.InFailedSqlTransaction:
-            # Rollback the aborted transaction
-            self.connection.rollback()
-            print("Rolled back failed transaction")
-        except Exception as e:
-            # If connection is in a bad state, close and reconnect
-            print(f"Connection check failed: {e}")
+        """
+        Execute an SQL query and return the results as a list of dictionaries.
+
+        The query runs on a connection borrowed from the pool for its duration
+        only. A connection that errored is rolled back here and validated by
+        the pool before it is handed out again. User SQL that may change
+        session state (SET search_path, statement_timeout, temporary tables)
+        has its connection reset with DISCARD ALL before other sessions reuse
+        it; other queries are returned as they are.
+        """
+        with self.checkout(reset=may_change_session(query)) as connection:
+            cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
             try:
-                self.connection.close()
-            except:
-                pass
-            self.connect()
-            
-        cursor = self.connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        try:
-            cursor.execute(query)
-
-            # Get column names
-            columns = [desc[0] for desc in cursor.description] if cursor.description else []
-
-            # Fetch all results
-            results = []
-            for row in cursor.fetchall():
-                result_dict = {}
-                for i, column in enumerate(columns):
-                    result_dict[column] = row[i]
-                results.append(result_dict)
-
-            # Explicitly commit the transaction if successful
-            self.connection.commit()
-            return results, columns
-        except Exception as e:
-            # Explicitly rollback the transaction on error
-            self.connection.rollback()
-            raise Exception(f"Error executing query: {e}")
-        finally:
-            cursor.close()
+                cursor.execute(query)
+
+                # Get column names
+                columns = [desc[0] for desc in cursor.description] if cursor.description else []
+
+                # Fetch all results
+                results = []
+                for row in cursor.fetchall():
+                    result_dict = {}
+                    for i, column in enumerate(columns):
+                        result_dict[column] = row[i]
+                    results.append(result_dict)
+
+                # Explicitly commit the transaction if successful
+                connection.commit()
+                return results, columns
+            except Exception as e:
+                # Explicitly rollback the transaction on error
+                if not connection.closed:
+                    connection.rollback()
+                raise Exception(f"Error executing query: {e}")
+            finally:
+                cursor.close()
 
     def check_connection_health(self) -> bool:
         """
-        Check if the database connection is healthy and not in a failed transaction state.
-        Returns True if connection is good, False otherwise.
+        Check if the database is reachable through the connection pool.
+        Returns True if a connection can be checked out, False otherwise.
         """
-        if not self.connection:
+        if not self.pool:
             return False
-            
+
         try:
-            check_cursor = self.connection.cursor()
-            check_cursor.execute("SELECT 1")
-            check_cursor.close()
-            return True
-        except psycopg2.errors.InFailedSqlTransaction:
-            # Rollback the aborted transaction
-            self.connection.rollback()
-            print("Rolled back failed transaction")
-            return True
+            with self.pool.connection():
+                return True
         except Exception as e:
             print(f"Connection health check failed: {e}")
             return False
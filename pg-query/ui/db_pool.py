@@ -0,0 +1,196 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+
+import psycopg2
+import psycopg2.extensions
+
+# Connections per database, shared by every session of the process.
+POOL_MIN_CONNECTIONS = int(os.getenv("PG_POOL_MIN_CONNECTIONS", "1"))
+POOL_MAX_CONNECTIONS = int(os.getenv("PG_POOL_MAX_CONNECTIONS", "10"))
+# Seconds to wait for a free connection when all of them are checked out.
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("PG_POOL_CHECKOUT_TIMEOUT", "30"))
+# Connections idle longer than this are validated before reuse, and closed
+# while the pool holds more than its minimum.
+POOL_IDLE_TIMEOUT = float(os.getenv("PG_POOL_IDLE_TIMEOUT", "300"))
+
+# SQL that can leave state behind in the session: SET/RESET and the other
+# session-level commands at the start of a statement, temporary objects,
+# set_config() and session advisory locks. Matches are a superset, e.g. an
+# UPDATE with SET on its own line, which only costs a needless reset.
+SESSION_STATE_PATTERN = re.compile(
+    r"(?:^|;)\s*(?:SET|RESET|PREPARE|LISTEN|DECLARE|LOAD)\b|\bTEMP(?:ORARY)?\b|\bset_config\s*\(|\bpg_advisory_lock",
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+def may_change_session(sql: str) -> bool:
+    """Whether SQL may change session state, so its connection needs a reset before reuse."""
+    return bool(SESSION_STATE_PATTERN.search(sql))
+
+
+class PoolTimeoutError(Exception):
+    """No database connection became free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections to one database.
+
+    Connections are checked out for one unit of work and returned right
+    after, so the number of backends follows concurrent queries rather than
+    open browser tabs, and never exceeds max_connections. A connection is
+    only validated with a round trip when it is returned after an error or
+    has sat idle past idle_timeout; otherwise it is handed out as is.
+    """
+
+    def __init__(self, params: Dict[str, Any], min_connections: int = POOL_MIN_CONNECTIONS,
+                 max_connections: int = POOL_MAX_CONNECTIONS, idle_timeout: float = POOL_IDLE_TIMEOUT,
+                 checkout_timeout: float = POOL_CHECKOUT_TIMEOUT):
+        self.params = params
+        self.min_connections = min(min_connections, max_connections)
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.condition = threading.Condition()
+        self.idle = []  # (connection, returned_at, suspect), most recently returned last
+        self.size = 0  # Open connections, idle or checked out
+        for _ in range(self.min_connections):
+            self.idle.append((self._open(), time.monotonic(), False))
+            self.size += 1
+
+    def _open(self):
+        return psycopg2.connect(**self.params)
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        except Exception as e:
+            print(f"Discarding unhealthy database connection: {e}")
+            return False
+
+    def getconn(self):
+        """Check out a connection, waiting up to checkout_timeout for one to be returned."""
+        deadline = time.monotonic() + self.checkout_timeout
+        with self.condition:
+            while True:
+                if self.idle:
+                    connection, returned_at, suspect = self.idle.pop()
+                    break
+                if self.size < self.max_connections:
+                    self.size += 1
+                    connection = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(f"All {self.max_connections} database connections are busy")
+                self.condition.wait(remaining)
+
+        if connection is not None:
+            needs_check = suspect or connection.closed or time.monotonic() - returned_at > self.idle_timeout
+            if not needs_check or self._is_healthy(connection):
+                return connection
+            self._discard(connection)
+
+        # A new connection takes the slot reserved above (or the discarded one's).
+        try:
+            return self._open()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+    @staticmethod
+    def _reset(connection):
+        # DISCARD ALL cannot run inside a transaction block.
+        autocommit = connection.autocommit
+        connection.autocommit = True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("DISCARD ALL")
+            cursor.close()
+        finally:
+            connection.autocommit = autocommit
+
+    def putconn(self, connection, failed: bool = False, reset: bool = False):
+        """
+        Return a connection; one returned after an error is validated before its
+        next use. With reset, session state the borrower may have changed (SET
+        parameters, temporary tables, prepared statements, advisory locks) is
+        discarded first, and the connection is closed if that fails.
+        """
+        usable = not connection.closed
+        if usable and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except Exception:
+                usable = False
+        if usable and reset:
+            try:
+                self._reset(connection)
+            except Exception as e:
+                print(f"Discarding database connection that could not be reset: {e}")
+                usable = False
+        if not usable:
+            self._discard(connection)
+
+        now = time.monotonic()
+        expired = []
+        with self.condition:
+            if usable:
+                self.idle.append((connection, now, failed))
+            else:
+                self.size -= 1
+            # Shrink back towards the minimum, oldest idle connections first.
+            while self.size > self.min_connections and self.idle and now - self.idle[0][1] > self.idle_timeout:
+                expired.append(self.idle.pop(0)[0])
+                self.size -= 1
+            self.condition.notify()
+        for idle_connection in expired:
+            self._discard(idle_connection)
+
+    @contextmanager
+    def connection(self, reset: bool = False):
+        """Check out a connection for the duration of a with block; see putconn for reset."""
+        connection = self.getconn()
+        failed = False
+        try:
+            yield connection
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.putconn(connection, failed, reset)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(params: Dict[str, Any]) -> ConnectionPool:
+    """Return the process-wide pool for a set of connection parameters, creating it on first use."""
+    key = tuple(sorted((name, str(value)) for name, value in params.items()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(params)
+        return _pools[key]
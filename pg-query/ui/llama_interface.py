@@ -1,9 +1,9 @@
 import json
-import httpx
 import asyncio
 import re
 from typing import List, Dict, Any
 
+from llama_client import get_llama_client
 from utils import extract_sql_from_response
 
 class LlamaInterface:
@@ -13,27 +13,24 @@ class LlamaInterface:
         """Initialize the LLM Runtime interface with host and port."""
         self.host = host
         self.port = port
+        self.client = get_llama_client(host, port)
+
+    async def stream_llama_response(self, prompt):
+        """Yield response tokens from the LLM Runtime API as they are generated."""
+        async for token in self.client.stream(
+            prompt,
+            deadline=120,
+            temperature=0.1,
+            n_predict=500,
+            cache_prompt=True,
+        ):
+            yield token
 
     async def get_llama_response(self, prompt):
         """Get a response from the LLM Runtime API."""
-        json_data = {
-            'prompt': prompt,
-            'temperature': 0.1,
-            'n_predict': 500,
-            'stream': True,
-        }
-
-        async with httpx.AsyncClient(timeout=120) as client:
-            async with client.stream('POST', f'http://{self.host}:{self.port}/completion', json=json_data) as response:
-                full_response = ""
-                async for chunk in response.aiter_bytes():
-                    try:
-                        data = json.loads(chunk.decode('utf-8')[6:])
-                        if data['stop'] is False:
-                            full_response += data['content']
-                    except:
-                        pass
-
+        full_response = ""
+        async for token in self.stream_llama_response(prompt):
+            full_response += token
         return full_response
 
     async def generate_sql_async(self, question: str, schema_description: str) -> str:
@@ -75,8 +72,8 @@ Make sure the query inside the backticks is valid PostgreSQL syntax with no comm
         """Synchronous wrapper for generate_sql_async."""
         return asyncio.run(self.generate_sql_async(question, schema_description))
 
-    async def explain_results_async(self, question: str, sql_query: str, results: List[Dict[str, Any]], error: str = None) -> str:
-        """Explain the results in natural language with enhanced semantic awareness."""
+    def build_explanation_prompt(self, question: str, sql_query: str, results: List[Dict[str, Any]], error: str = None) -> str:
+        """Build the prompt asking the LLM to explain query results or a query error."""
         if error:
             prompt = f"""
 Question: {question}
@@ -111,9 +108,20 @@ Keep your explanation clear, concise, and focused on what the user actually aske
 If the results contain a lot of data, summarize the key points.
 """
 
+        return prompt
+
+    async def explain_results_async(self, question: str, sql_query: str, results: List[Dict[str, Any]], error: str = None) -> str:
+        """Explain the results in natural language with enhanced semantic awareness."""
+        prompt = self.build_explanation_prompt(question, sql_query, results, error)
         explanation = await self.get_llama_response(prompt)
         return explanation.strip()
 
+    async def stream_explanation_async(self, question: str, sql_query: str, results: List[Dict[str, Any]], error: str = None):
+        """Yield the explanation tokens as the LLM generates them."""
+        prompt = self.build_explanation_prompt(question, sql_query, results, error)
+        async for token in self.stream_llama_response(prompt):
+            yield token
+
     def explain_results(self, question: str, sql_query: str, results: List[Dict[str, Any]], error: str = None) -> str:
         """Synchronous wrapper for explain_results_async."""
         return asyncio.run(self.explain_results_async(question, sql_query, results, error))
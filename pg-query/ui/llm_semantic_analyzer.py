@@ -1,38 +1,39 @@
-import json
-import httpx
 import asyncio
+import os
 import re
 from typing import List, Dict, Any, Optional
 
+from llama_client import get_llama_client
+
+# Inference requests sent to the llama.cpp server at once by all sessions of
+# the process; 0 matches the server's parallel slots.
+SEMANTIC_CONCURRENCY = int(os.getenv("SEMANTIC_CONCURRENCY", "0"))
+# Seconds each request may wait for its first token once it has a slot, including retries.
+SEMANTIC_REQUEST_DEADLINE = float(os.getenv("SEMANTIC_REQUEST_DEADLINE", "60"))
+
 class LLMSemanticAnalyzer:
     """Class to analyze and infer column semantics using LLM with enhanced context awareness."""
 
-    def __init__(self, llm_service_host="llama-service", llm_service_port="8080"):
+    def __init__(self, llm_service_host="llama-service", llm_service_port="8080",
+                 concurrency: int = SEMANTIC_CONCURRENCY, deadline: float = SEMANTIC_REQUEST_DEADLINE):
         """Initialize the semantic analyzer with LLM service connection details."""
         self.llm_service_host = llm_service_host
         self.llm_service_port = llm_service_port
+        self.client = get_llama_client(llm_service_host, llm_service_port)
+        if concurrency:
+            # The limit lives on the shared client, so it holds across sessions.
+            self.client.slot_limit = concurrency
+        self.deadline = deadline
 
     async def get_llm_response(self, prompt: str) -> str:
-        """Get a response from the LLM Runtime API."""
-        json_data = {
-            'prompt': prompt,
-            'temperature': 0.1,
-            'n_predict': 200,
-            'stream': True,
-        }
-
-        async with httpx.AsyncClient(timeout=60) as client:
-            async with client.stream('POST', f'http://{self.llm_service_host}:{self.llm_service_port}/completion',
-                                    json=json_data) as response:
-                full_response = ""
-                async for chunk in response.aiter_bytes():
-                    try:
-                        data = json.loads(chunk.decode('utf-8')[6:])
-                        if data['stop'] is False:
-                            full_response += data['content']
-                    except:
-                        pass
-
+        """Get a response from the LLM Runtime API, waiting for a free server slot first."""
+        full_response = await self.client.complete(
+            prompt,
+            deadline=self.deadline,
+            wait_for_slot=True,
+            temperature=0.1,
+            n_predict=200,
+        )
         return full_response.strip()
 
     async def infer_column_semantics_async(self,
@@ -227,9 +228,8 @@ Response:"""
                 columns_by_table[table_name] = []
             columns_by_table[table_name].append(col_info)
 
-        # Process each table's columns with better context
-        all_semantics = {}
-        for table_name, table_columns in columns_by_table.items():
+        # Process each table's columns with better context, one concurrent request per table
+        async def infer_table(table_name, table_columns):
             # Build comprehensive prompt for this table's columns
             prompt = f"""You are an expert database analyst helping infer the semantic meaning of database columns.
 I'll provide information about multiple columns from the table '{table_name}'. For each column, infer its business meaning based on:
@@ -304,15 +304,19 @@ Do not include any introductory text or explanations beyond these specific answe
 
                         semantics[col_key] = description
 
-            # Add to overall results
-            all_semantics.update(semantics)
-
             # Fill in any missing columns with generic descriptions
             for col_info in table_columns:
                 col_key = f"{col_info['table_name']}.{col_info['column_name']}"
-                if col_key not in all_semantics:
-                    all_semantics[col_key] = f"Column related to {col_info['column_name'].replace('_', ' ')}"
+                if col_key not in semantics:
+                    semantics[col_key] = f"Column related to {col_info['column_name'].replace('_', ' ')}"
+
+            return semantics
 
+        all_semantics = {}
+        results = await asyncio.gather(*(infer_table(table_name, table_columns)
+                                         for table_name, table_columns in columns_by_table.items()))
+        for semantics in results:
+            all_semantics.update(semantics)
         return all_semantics
 
     def batch_infer_column_semantics(self,
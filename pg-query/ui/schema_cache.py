@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2.extras
+
+# Analyzed schemas are kept as one JSON file per catalog fingerprint.
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", "/.cache/schemas")
+
+# Optionally also keep them in the analyzed database itself, so every replica
+# and every restart shares one copy. The table lives outside the public schema
+# so that it never shows up in (or changes) the catalog it describes.
+SCHEMA_CACHE_IN_DATABASE = os.getenv("SCHEMA_CACHE_IN_DATABASE", "false").lower() in ("1", "true", "yes")
+SCHEMA_CACHE_SCHEMA = os.getenv("SCHEMA_CACHE_SCHEMA", "sql_assistant")
+
+# Sample rows are per database and cheap to re-read, so they are not cached.
+UNCACHED_KEYS = ("sample_data",)
+
+
+def catalog_fingerprint(snapshot: Dict[str, Any]) -> str:
+    """Hash a catalog snapshot (tables, columns, types, keys) into a cache key."""
+    canonical = json.dumps(snapshot, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _column_links(snapshot: Dict[str, Any]) -> Dict[Tuple[str, str], List[str]]:
+    """Foreign keys touching each column, in both directions, as they appear in inference prompts."""
+    links = {}
+    for fk in snapshot["foreign_keys"]:
+        links.setdefault((fk["table"], fk["column"]), []).append(
+            f"references {fk['foreign_table']}.{fk['foreign_column']}")
+        links.setdefault((fk["foreign_table"], fk["foreign_column"]), []).append(
+            f"referenced by {fk['table']}.{fk['column']}")
+    return {key: sorted(value) for key, value in links.items()}
+
+
+def diff_catalogs(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compare two catalog snapshots.
+
+    A column counts as altered when something its inferred meaning depends on
+    changed: its type or the foreign keys that touch it. Other attribute
+    changes (nullability, defaults, lengths) only mark its table as changed.
+    """
+    previous_tables, current_tables = previous["tables"], current["tables"]
+    previous_links, current_links = _column_links(previous), _column_links(current)
+
+    changes = {
+        "added_tables": [table for table in current_tables if table not in previous_tables],
+        "removed_tables": [table for table in previous_tables if table not in current_tables],
+        "changed_tables": [],
+        "columns": {},
+    }
+    for table, entry in current_tables.items():
+        old_entry = previous_tables.get(table, {"columns": [], "comment": ""})
+        old_columns = {column["name"]: column for column in old_entry["columns"]}
+        new_names = {column["name"] for column in entry["columns"]}
+        columns = {
+            "added": [column["name"] for column in entry["columns"] if column["name"] not in old_columns],
+            "altered": [column["name"] for column in entry["columns"]
+                        if column["name"] in old_columns
+                        and (column["type"] != old_columns[column["name"]]["type"]
+                             or current_links.get((table, column["name"])) != previous_links.get((table, column["name"])))],
+            "removed": [name for name in old_columns if name not in new_names],
+        }
+        if any(columns.values()):
+            changes["columns"][table] = columns
+        if entry != old_entry:
+            changes["changed_tables"].append(table)
+    return changes
+
+
+class SchemaCache:
+    """
+    Persistent store of LLM schema analyses keyed by catalog fingerprint.
+
+    An unchanged schema has an unchanged fingerprint, so a restart or another
+    session finds the previous schema_info and column semantics instead of
+    re-inferring every table and column through the LLM. Any change to a
+    table, column, type or key changes the fingerprint and misses the cache;
+    the latest analysis of the same database is then the starting point for
+    re-analyzing only what changed.
+    """
+
+    def __init__(self, directory: str = SCHEMA_CACHE_DIR, in_database: bool = SCHEMA_CACHE_IN_DATABASE,
+                 schema: str = SCHEMA_CACHE_SCHEMA):
+        self.directory = directory
+        self.in_database = in_database
+        self.schema = schema
+        self._table_ready = False
+
+    def _path(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, f"{fingerprint}.json")
+
+    def _latest_path(self, database: str) -> str:
+        key = hashlib.sha256(database.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"latest-{key}")
+
+    def load(self, fingerprint: str, connection=None) -> Optional[Dict[str, Any]]:
+        """Return the cached analysis for a fingerprint, or None."""
+        entry = self._load_file(fingerprint)
+        if entry is None and self.in_database and connection is not None:
+            entry = self._load_database(fingerprint, connection)
+            if entry is not None:
+                self._save_file(fingerprint, entry)
+        return entry
+
+    def load_latest(self, database: str, connection=None) -> Optional[Dict[str, Any]]:
+        """Return the most recent analysis stored for a database, whatever its fingerprint."""
+        try:
+            with open(self._latest_path(database)) as file:
+                entry = self._load_file(file.read().strip())
+        except OSError:
+            entry = None
+        if entry is None and self.in_database and connection is not None:
+            entry = self._load_database(None, connection)
+        return entry
+
+    def save(self, fingerprint: str, entry: Dict[str, Any], connection=None, database: str = None):
+        """Store an analysis locally and, if enabled, in the database."""
+        entry = {key: value for key, value in entry.items() if key not in UNCACHED_KEYS}
+        self._save_file(fingerprint, entry)
+        if database:
+            self._write_latest(database, fingerprint)
+        if self.in_database and connection is not None:
+            self._save_database(fingerprint, entry, connection)
+
+    def _write_latest(self, database: str, fingerprint: str):
+        try:
+            path = self._latest_path(database)
+            with open(path + ".tmp", "w") as file:
+                file.write(fingerprint)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not write schema cache {self.directory}: {e}")
+
+    def _load_file(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(fingerprint)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            print(f"Discarding unreadable schema cache {self._path(fingerprint)}: {e}")
+            return None
+
+    def _save_file(self, fingerprint: str, entry: Dict[str, Any]):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(fingerprint)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(entry, file, default=str)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write schema cache {self.directory}: {e}")
+
+    def _ensure_table(self, cursor):
+        if self._table_ready:
+            return
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {self.schema}")
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.schema}.schema_cache (
+                fingerprint text PRIMARY KEY,
+                entry jsonb NOT NULL,
+                analyzed_at timestamptz NOT NULL DEFAULT now()
+            )
+        """)
+        self._table_ready = True
+
+    def _load_database(self, fingerprint: Optional[str], connection) -> Optional[Dict[str, Any]]:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT to_regclass(%s)", (f"{self.schema}.schema_cache",))
+            if cursor.fetchone()[0] is None:
+                connection.rollback()
+                return None
+            if fingerprint is None:
+                cursor.execute(f"SELECT entry FROM {self.schema}.schema_cache ORDER BY analyzed_at DESC LIMIT 1")
+            else:
+                cursor.execute(f"SELECT entry FROM {self.schema}.schema_cache WHERE fingerprint = %s", (fingerprint,))
+            row = cursor.fetchone()
+            connection.commit()
+            return row[0] if row else None
+        except Exception as e:
+            connection.rollback()
+            print(f"Could not read schema cache from the database: {e}")
+            return None
+        finally:
+            cursor.close()
+
+    def _save_database(self, fingerprint: str, entry: Dict[str, Any], connection):
+        cursor = connection.cursor()
+        try:
+            self._ensure_table(cursor)
+            cursor.execute(f"""
+                INSERT INTO {self.schema}.schema_cache (fingerprint, entry)
+                VALUES (%s, %s)
+                ON CONFLICT (fingerprint) DO UPDATE SET entry = EXCLUDED.entry, analyzed_at = now()
+            """, (fingerprint, psycopg2.extras.Json(entry, dumps=lambda value: json.dumps(value, default=str))))
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            self._table_ready = False
+            print(f"Could not write schema cache to the database: {e}")
+        finally:
+            cursor.close()
@@ -8,7 +8,7 @@ import re
 # Import our modules
 from database_analyzer import DatabaseAnalyzer
 from llama_interface import LlamaInterface
-from utils import extract_sql_from_response
+from utils import extract_sql_from_response, render_token_stream, format_stream_timing
 
 # Set page config at the top level before any other Streamlit commands
 st.set_page_config(
@@ -17,6 +17,12 @@ st.set_page_config(
     layout="wide"
 )
 
+def show_inference_errors(analyzer):
+    """Warn in the sidebar when LLM requests of the last analysis failed or timed out."""
+    if analyzer.inference_errors:
+        st.sidebar.warning(f"{analyzer.inference_errors} LLM requests failed or timed out; the affected tables "
+                           "and columns have heuristic or no semantics. Run the analysis again to retry them.")
+
 def main():
     st.title("SQL Assistant powered by Power10 MMA")
     st.write("Ask questions about your PostgreSQL database in plain English. Enhanced with intelligent schema semantics.")
@@ -117,14 +123,24 @@ def main():
         st.sidebar.header("LLM Enhanced Schema Analysis")
         st.sidebar.write("Enhance database understanding with LLM-powered semantic analysis.")
 
+        refresh_semantics = st.sidebar.checkbox("Re-analyze every table", value=False,
+                                                help="Ignore the stored semantics and ask the LLM about every table and column "
+                                                     "again, instead of only the ones that changed.")
         if st.sidebar.button("Run Full Schema Analysis"):
             if st.session_state.get('llm_initialized', False):
                 with st.spinner("Analyzing complete database schema with LLM..."):
                     try:
-                        schema_info = st.session_state['db_analyzer'].analyze_schema_with_llm()
+                        schema_info = st.session_state['db_analyzer'].analyze_schema_with_llm(refresh=refresh_semantics)
                         st.session_state['schema_description'] = st.session_state['db_analyzer'].generate_schema_description()
                         st.session_state['schema_for_llm'] = st.session_state['db_analyzer'].generate_schema_for_llm()
                         st.sidebar.success("Schema analysis completed with LLM enhancement!")
+                        show_inference_errors(st.session_state['db_analyzer'])
+                        changes = st.session_state['db_analyzer'].last_changes
+                        if changes is not None:
+                            column_count = sum(len(columns["added"]) + len(columns["altered"])
+                                               for columns in changes["columns"].values())
+                            st.sidebar.info(f"Schema changed since the last analysis: re-analyzed {column_count} columns, "
+                                            f"{len(changes['added_tables'])} new and {len(changes['removed_tables'])} dropped tables.")
                     except Exception as e:
                         st.sidebar.error(f"Error in LLM schema analysis: {str(e)}")
                         st.sidebar.info("Falling back to heuristic analysis...")
@@ -154,6 +170,7 @@ def main():
                             st.session_state['schema_for_llm'] = st.session_state['db_analyzer'].generate_schema_for_llm()
 
                             st.sidebar.success(f"Enhanced semantic analysis of {selected_table} completed!")
+                            show_inference_errors(st.session_state['db_analyzer'])
                         except Exception as e:
                             st.sidebar.error(f"Error enhancing table: {str(e)}")
                 else:
@@ -296,17 +313,20 @@ IMPORTANT: I will only execute the code found between the triple backticks, so m
                             # Now execute the query
                             results, columns = st.session_state['db_analyzer'].execute_query(sql_query)
 
-                            # Generate explanation
-                            with st.spinner("Generating explanation with LLM..."):
-                                explanation = st.session_state['llama_interface'].explain_results(
+                            # Generate and display the explanation as it streams in
+                            st.subheader("Answer")
+                            explanation_placeholder = st.empty()
+                            explanation_placeholder.markdown("_Generating explanation with LLM..._")
+                            explanation, ttft, total = asyncio.run(render_token_stream(
+                                st.session_state['llama_interface'].stream_explanation_async(
                                     question,
                                     sql_query,
                                     results
-                                )
-
-                            # Display explanation
-                            st.subheader("Answer")
-                            st.write(explanation)
+                                ),
+                                explanation_placeholder
+                            ))
+                            explanation = explanation.strip()
+                            st.caption(format_stream_timing(ttft, total))
 
                             # Display results as a table if available
                             if results and columns:
@@ -340,17 +360,20 @@ IMPORTANT: I will only execute the code found between the triple backticks, so m
                             if st.button("Try Again", key="retry_query"):
                                 st.experimental_rerun()
                             
-                            # Generate explanation for the error
-                            with st.spinner("Analyzing the error with LLM..."):
-                                error_explanation = st.session_state['llama_interface'].explain_results(
+                            # Generate and display the error explanation as it streams in
+                            st.subheader("Error Analysis")
+                            error_placeholder = st.empty()
+                            error_placeholder.markdown("_Analyzing the error with LLM..._")
+                            error_explanation, ttft, total = asyncio.run(render_token_stream(
+                                st.session_state['llama_interface'].stream_explanation_async(
                                     question,
                                     sql_query,
                                     [],
                                     error=str(e)
-                                )
-
-                            st.subheader("Error Analysis")
-                            st.write(error_explanation)
+                                ),
+                                error_placeholder
+                            ))
+                            st.caption(format_stream_timing(ttft, total))
 
                             # Offer manual edit option
                             st.subheader("Fix the Query")
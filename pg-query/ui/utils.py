@@ -1,5 +1,6 @@
 import re
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Tuple
 
 def extract_sql_from_response(response: str) -> str:
     """
@@ -21,6 +22,69 @@ def extract_sql_from_response(response: str) -> str:
         return ""
 
 
+async def render_token_stream(tokens, placeholder) -> Tuple[str, Optional[float], float]:
+    """
+    Render an async stream of LLM tokens into a Streamlit placeholder as they arrive.
+
+    Returns the full text, the time to first token (None if nothing was generated)
+    and the total generation time, both in seconds.
+    """
+    start = time.perf_counter()
+    time_to_first_token = None
+    text = ""
+    async for token in tokens:
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - start
+        text += token
+        placeholder.markdown(text + "▌")
+    placeholder.markdown(text)
+    return text, time_to_first_token, time.perf_counter() - start
+
+
+def format_stream_timing(time_to_first_token: Optional[float], total: float) -> str:
+    """Describe the latency of a streamed response for display under the answer."""
+    if time_to_first_token is None:
+        return f"No tokens received after {total:.2f}s"
+    return f"Time to first token: {time_to_first_token:.2f}s · Total: {total:.2f}s"
+
+
+class InferenceProgress:
+    """
+    Progress of concurrent LLM requests, shown in optional Streamlit
+    placeholders as the requests finish in whatever order they complete.
+    """
+
+    def __init__(self, placeholder=None, progress_bar=None):
+        self.placeholder = placeholder
+        self.progress_bar = progress_bar
+        self.total = 0
+        self.finished = 0
+        self.start = time.perf_counter()
+
+    def expect(self, count: int):
+        """Add requests that are about to be sent."""
+        self.total += count
+        self._show("")
+
+    def finish(self, label: str):
+        """Record one finished request."""
+        self.finished += 1
+        self._show(label)
+
+    def _show(self, label: str):
+        if self.placeholder:
+            elapsed = time.perf_counter() - self.start
+            text = f"LLM requests finished: {self.finished} of {self.total} ({elapsed:.0f}s)"
+            self.placeholder.text(f"{text} · {label}" if label else text)
+        if self.progress_bar and self.total:
+            self.progress_bar.progress(self.finished / self.total)
+
+    def clear(self):
+        if self.placeholder:
+            self.placeholder.empty()
+        if self.progress_bar:
+            self.progress_bar.empty()
+
 
 def infer_column_semantics_heuristic(table_name: str, column_name: str, data_type: str) -> str:
     """
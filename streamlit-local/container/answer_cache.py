@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Answers to earlier questions, looked up by question embedding.
+
+    A question is a hit when its cosine similarity to a cached question reaches
+    threshold. Entries expire after ttl seconds, the least recently used entry
+    is dropped beyond max_entries, and everything is discarded when the corpus
+    version changes so answers never outlive the documents they came from.
+    """
+
+    def __init__(self, embeddings, threshold: float = 0.95, ttl: float = 3600, max_entries: int = 256):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.corpus_version = None
+        self.entries = OrderedDict()  # question -> (unit vector, answer, stored_at)
+        self.lock = threading.Lock()
+
+    def embed(self, question: str) -> np.ndarray:
+        """Embed a question with the same model used for the documents."""
+        return np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _check_version(self, corpus_version: str):
+        if corpus_version != self.corpus_version:
+            self.entries.clear()
+            self.corpus_version = corpus_version
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for question in [q for q, (_, _, stored_at) in self.entries.items() if stored_at < cutoff]:
+            del self.entries[question]
+
+    def lookup(self, question_vector: np.ndarray, corpus_version: str):
+        """Return (answer, similarity) for the closest cached question above threshold, or None."""
+        with self.lock:
+            self._check_version(corpus_version)
+            self._expire()
+            if not self.entries:
+                return None
+            questions = list(self.entries)
+            similarities = np.stack([self.entries[q][0] for q in questions]) @ self._unit(question_vector)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            self.entries.move_to_end(questions[best])
+            return self.entries[questions[best]][1], float(similarities[best])
+
+    def store(self, question: str, question_vector: np.ndarray, answer: str, corpus_version: str):
+        """Remember the answer to a question for the given corpus version."""
+        with self.lock:
+            self._check_version(corpus_version)
+            self.entries[question] = (self._unit(question_vector), answer, time.time())
+            self.entries.move_to_end(question)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,196 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from langchain.docstore.document import Document
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from had has have he her his i in is it its of on or she that the their them
+they this to was were what when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """Lowercase word and number tokens without common stopwords."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index over chunk text for Okapi BM25 keyword search.
+
+    Chunks are keyed by their chunk_hash, so the index stays in step with the
+    vector store through the same incremental ingestion. doc_versions records
+    which version of each document the index covers, mirroring the ingestion
+    manifest, so a lost or stale index file is rebuilt from the stored chunks
+    without re-embedding anything.
+
+    Postings are kept per source document, so a search scoped to some
+    documents only scores their chunks. Term document frequencies stay
+    corpus-wide, so a chunk scores the same whatever the scope.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.RLock()
+        self._clear()
+        self._load()
+
+    def _clear(self):
+        self.chunks = {}  # chunk_hash -> {"text", "metadata", "length"}
+        self.postings = {}  # doc_url -> term -> {chunk_hash: term frequency}
+        self.doc_freq = Counter()  # term -> number of chunks containing it
+        self.total_length = 0
+        self.doc_versions = {}
+
+    def version_path(self, version: str) -> str:
+        """Path of the index kept with one version of the store, next to this one."""
+        return os.path.join(os.path.dirname(self.path), f"{version}.json")
+
+    def for_version(self, version: str) -> "BM25Index":
+        """Open the index kept with one version of the store, with the same parameters."""
+        return BM25Index(self.version_path(version), self.k1, self.b)
+
+    def open(self, path: str):
+        """Replace the contents with the index saved at path, or an empty one if there is none."""
+        with self.lock:
+            if path == self.path:
+                return
+            self.path = path
+            self._clear()
+            self._load()
+
+    def adopt(self, other: "BM25Index"):
+        """Serve another index, e.g. the one built for a new store version, in place of this one."""
+        with self.lock, other.lock:
+            self.path = other.path
+            self.chunks = other.chunks
+            self.postings = other.postings
+            self.doc_freq = other.doc_freq
+            self.total_length = other.total_length
+            self.doc_versions = other.doc_versions
+
+    def copy_document(self, other: "BM25Index", url: str):
+        """Index the chunks of one document from another index, with its version."""
+        with other.lock:
+            chunks = [(key, chunk["text"], chunk["metadata"]) for key, chunk in other.chunks.items()
+                      if chunk["metadata"].get("doc_url") == url]
+            version = other.doc_versions.get(url)
+        with self.lock:
+            for key, text, metadata in chunks:
+                if key not in self.chunks:
+                    self._add(key, text, dict(metadata))
+            if version is not None:
+                self.doc_versions[url] = version
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (ValueError, OSError) as e:
+            print(f"Discarding unreadable BM25 index {self.path}: {e}")
+            return
+        for key, chunk in data["chunks"].items():
+            self._add(key, chunk["text"], chunk["metadata"])
+        self.doc_versions = data["doc_versions"]
+
+    def save(self):
+        """Write the index next to the vectors, replacing the previous file atomically."""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump({
+                    "chunks": {key: {"text": chunk["text"], "metadata": chunk["metadata"]}
+                               for key, chunk in self.chunks.items()},
+                    "doc_versions": self.doc_versions,
+                }, file)
+            os.replace(tmp_path, self.path)
+
+    def _add(self, key: str, text: str, metadata: dict):
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self.chunks[key] = {"text": text, "metadata": metadata, "length": length}
+        self.total_length += length
+        postings = self.postings.setdefault(metadata.get("doc_url", ""), {})
+        for term, count in terms.items():
+            postings.setdefault(term, {})[key] = count
+        self.doc_freq.update(terms.keys())
+
+    def add_documents(self, documents: list):
+        """Index chunks, skipping ones that are already present."""
+        with self.lock:
+            for doc in documents:
+                key = doc.metadata["chunk_hash"]
+                if key not in self.chunks:
+                    self._add(key, doc.page_content, dict(doc.metadata))
+
+    def remove(self, keys: list):
+        """Drop chunks by chunk_hash."""
+        with self.lock:
+            for key in keys:
+                chunk = self.chunks.pop(key, None)
+                if chunk is None:
+                    continue
+                self.total_length -= chunk["length"]
+                url = chunk["metadata"].get("doc_url", "")
+                source_postings = self.postings.get(url, {})
+                for term in set(tokenize(chunk["text"])):
+                    postings = source_postings.get(term)
+                    if postings is not None and postings.pop(key, None) is not None:
+                        if not postings:
+                            del source_postings[term]
+                        self.doc_freq[term] -= 1
+                        if not self.doc_freq[term]:
+                            del self.doc_freq[term]
+                if not source_postings:
+                    self.postings.pop(url, None)
+
+    def document_urls(self) -> set:
+        """URLs of the documents the index holds chunks of."""
+        with self.lock:
+            return {chunk["metadata"]["doc_url"] for chunk in self.chunks.values()
+                    if "doc_url" in chunk["metadata"]} | set(self.doc_versions)
+
+    def remove_document(self, url: str, keep=()):
+        """Drop every chunk of one document, except the chunk hashes in keep."""
+        with self.lock:
+            keys = {key for postings in self.postings.get(url, {}).values() for key in postings}
+            self.remove([key for key in keys if key not in keep])
+            self.doc_versions.pop(url, None)
+
+    def replace_document(self, url: str, documents):
+        """Re-index every chunk of one document from the vector store."""
+        with self.lock:
+            self.remove_document(url)
+            self.add_documents(list(documents))
+
+    def search(self, query: str, k: int = 10, sources: list = None) -> list:
+        """Return the k best (Document, BM25 score) pairs for a query, optionally only from sources."""
+        with self.lock:
+            if not self.chunks:
+                return []
+            count = len(self.chunks)
+            average_length = self.total_length / count
+            scoped = [self.postings[url] for url in (sources or self.postings) if url in self.postings]
+            scores = Counter()
+            for term in set(tokenize(query)):
+                frequency_in_corpus = self.doc_freq.get(term)
+                if not frequency_in_corpus:
+                    continue
+                idf = math.log(1 + (count - frequency_in_corpus + 0.5) / (frequency_in_corpus + 0.5))
+                for source_postings in scoped:
+                    for key, frequency in source_postings.get(term, {}).items():
+                        norm = self.k1 * (1 - self.b + self.b * self.chunks[key]["length"] / average_length)
+                        scores[key] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            return [(Document(page_content=self.chunks[key]["text"], metadata=dict(self.chunks[key]["metadata"])),
+                     score) for key, score in scores.most_common(k)]
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+DEFAULT_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "/.cache/embeddings")
+DEFAULT_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256"))
+
+# Fraction of the cache freed at once when it is full, so eviction does not
+# run again on every insert.
+EVICT_FRACTION = 0.1
+
+# Index changes logged before they are folded into a new index snapshot, at
+# least. The log may grow as large as the index itself, so rewriting the
+# snapshot costs amortized constant time per insert.
+COMPACT_MIN_RECORDS = 1024
+
+
+def content_hash(text: str) -> str:
+    """Cache key for a chunk of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed store of embedding vectors on local disk.
+
+    Vectors live in a memory-mapped float32 matrix with one row per slot, and a
+    JSON index maps each text hash to its slot and last use time. Inserts append
+    their slot changes to a log next to the index snapshot instead of rewriting
+    it; last use times are only persisted with the next snapshot. Every embedding
+    configuration gets its own directory, so vectors from different models or
+    normalization settings never mix. When the matrix is full the least recently
+    used slots are reused.
+    """
+
+    def __init__(self, namespace: dict, cache_dir: str = DEFAULT_CACHE_DIR, max_mb: int = DEFAULT_MAX_MB):
+        key = hashlib.sha256(json.dumps(namespace, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.directory = os.path.join(cache_dir, key)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.vectors = None
+        self.dim = None
+        self.capacity = 0
+        self.slots = {}  # hash -> [slot, last_used]
+        self.free = []
+        self.generation = 0  # Snapshot the log records apply to
+        self.logged = 0  # Keys added or evicted in the log
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "namespace.json"), "w") as file:
+            json.dump(namespace, file, sort_keys=True)
+        self._load()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    @property
+    def _log_path(self) -> str:
+        return os.path.join(self.directory, "index.log")
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, "vectors.f32")
+
+    def _load(self):
+        """Open an existing cache, discarding it if the files do not agree."""
+        if not (os.path.exists(self._index_path) and os.path.exists(self._vectors_path)):
+            return
+        try:
+            with open(self._index_path) as file:
+                index = json.load(file)
+            self._open(index["dim"], index["capacity"], "r+")
+            self.slots = index["slots"]
+            self.generation = index.get("generation", 0)
+            self._replay()
+            used = {slot for slot, _ in self.slots.values()}
+            self.free = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+            if os.path.exists(self._log_path) and os.path.getsize(self._log_path):
+                # Start from a clean log, also dropping a record cut short by a crash.
+                self._compact()
+        except (ValueError, KeyError, OSError) as e:
+            print(f"Discarding unreadable embedding cache {self.directory}: {e}")
+            self.vectors = None
+            self.slots = {}
+            self.free = []
+
+    def _replay(self):
+        """Apply the index changes logged since the snapshot."""
+        if not os.path.exists(self._log_path):
+            return
+        with open(self._log_path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record["generation"] != self.generation:
+                    # Logged before a snapshot that was written but whose log was not cleared.
+                    continue
+                for key in record["evicted"]:
+                    self.slots.pop(key, None)
+                for key, slot in record["added"].items():
+                    self.slots[key] = [slot, record["time"]]
+                self.logged += len(record["evicted"]) + len(record["added"])
+
+    def _open(self, dim: int, capacity: int, mode: str):
+        self.dim = dim
+        self.capacity = capacity
+        self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+
+    def _create(self, dim: int):
+        capacity = max(1, self.max_bytes // (dim * 4))
+        self._open(dim, capacity, "w+")
+        self.slots = {}
+        self.free = list(range(capacity - 1, -1, -1))
+        self._compact()
+
+    def _evict(self) -> list:
+        """Free the least recently used slots and return their keys."""
+        count = max(1, int(self.capacity * EVICT_FRACTION))
+        oldest = sorted(self.slots.items(), key=lambda item: item[1][1])[:count]
+        for key, (slot, _) in oldest:
+            del self.slots[key]
+            self.free.append(slot)
+        return [key for key, _ in oldest]
+
+    def _compact(self):
+        """Write the whole index as a new snapshot and start an empty log."""
+        self.generation += 1
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"dim": self.dim, "capacity": self.capacity, "slots": self.slots,
+                       "generation": self.generation}, file)
+        os.replace(tmp_path, self._index_path)
+        open(self._log_path, "w").close()
+        self.logged = 0
+
+    def _append(self, evicted: list, added: dict, now: float):
+        """Log one batch of index changes, compacting once the log outgrows the index."""
+        with open(self._log_path, "a") as file:
+            file.write(json.dumps({"generation": self.generation, "time": now,
+                                   "evicted": evicted, "added": added}) + "\n")
+        self.logged += len(evicted) + len(added)
+        if self.logged > max(len(self.slots), COMPACT_MIN_RECORDS):
+            self._compact()
+
+    def get_many(self, keys: list) -> list:
+        """Return the cached vector for each key, or None where it is missing."""
+        with self.lock:
+            if self.vectors is None:
+                return [None] * len(keys)
+            now = time.time()
+            found = []
+            for key in keys:
+                entry = self.slots.get(key)
+                if entry is None:
+                    found.append(None)
+                else:
+                    entry[1] = now
+                    found.append(self.vectors[entry[0]].tolist())
+            return found
+
+    def put_many(self, keys: list, vectors: list):
+        """Store vectors under their keys and log the index changes."""
+        if not keys:
+            return
+        with self.lock:
+            if self.vectors is None or len(vectors[0]) != self.dim:
+                self._create(len(vectors[0]))
+            now = time.time()
+            evicted, added = [], {}
+            for key, vector in zip(keys, vectors):
+                if key in self.slots:
+                    continue
+                if not self.free:
+                    # Keys added and evicted within this batch never reach the log.
+                    evicted.extend(old for old in self._evict() if added.pop(old, None) is None)
+                slot = self.free.pop()
+                self.vectors[slot] = vector
+                self.slots[key] = [slot, now]
+                added[key] = slot
+            self.vectors.flush()
+            if evicted or added:
+                self._append(evicted, added, now)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrap an Embeddings model so documents that were embedded before cost a
+    cache lookup instead of a forward pass. Queries are passed straight through.
+    """
+
+    def __init__(self, embeddings: Embeddings, namespace: dict, cache_dir: str = DEFAULT_CACHE_DIR,
+                 max_mb: int = DEFAULT_MAX_MB):
+        self.embeddings = embeddings
+        self.cache = EmbeddingCache(namespace, cache_dir, max_mb)
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [content_hash(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+            self.cache.put_many([keys[i] for i in missing], computed)
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self.embeddings.embed_query(text)
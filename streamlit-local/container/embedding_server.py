@@ -0,0 +1,155 @@
+"""
+Embedding service shared by the app replicas on a node.
+
+Loads the sentence-transformers model once and serves POST /embed with
+{"texts": [...]}, answering {"model": ..., "embeddings": [[...], ...]}.
+Requests that arrive within EMBEDDING_BATCH_WAIT_MS of each other are
+embedded together in one forward pass of up to EMBEDDING_MAX_BATCH texts, so
+throughput grows with the number of concurrent users instead of each request
+paying for its own pass. GET /health reports readiness.
+
+    python embedding_server.py --port 8000
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "/work/")
+NORMALIZE_EMBEDDINGS = os.getenv("NORMALIZE_EMBEDDINGS", "true").lower() == "true"
+MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+
+class DynamicBatcher:
+    """
+    Collect concurrent embedding requests into shared forward passes.
+
+    Callers submit lists of texts and get a Future. A single worker thread
+    takes the first waiting request, keeps collecting until max_batch texts
+    are queued or max_wait has passed, runs encode once over all of them and
+    hands each caller its slice. A request larger than max_batch is encoded
+    on its own.
+    """
+
+    def __init__(self, encode, max_batch: int = MAX_BATCH, max_wait_ms: float = BATCH_WAIT_MS):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, texts: list) -> Future:
+        future = Future()
+        if texts:
+            self.requests.put((texts, future))
+        else:
+            future.set_result([])
+        return future
+
+    def _collect(self) -> list:
+        batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                texts, future = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append((texts, future))
+            size += len(texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                vectors = self.encode(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(vectors[start:start + len(request_texts)])
+                start += len(request_texts)
+
+
+def make_handler(batcher: DynamicBatcher, model_name: str):
+    class EmbeddingHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"model": model_name, "batches": batcher.batches, "texts": batcher.texts})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/embed":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                texts = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["texts"]
+                if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                    raise ValueError("texts must be a list of strings")
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            try:
+                vectors = batcher.submit(texts).result()
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, {"model": model_name, "embeddings": vectors})
+
+        def log_message(self, format, *args):
+            pass  # One line per request would drown the logs.
+
+    return EmbeddingHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched sentence embedding server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("EMBEDDING_PORT", "8000")))
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBEDDING_MODEL, cache_folder=MODEL_CACHE_DIR, device="cpu")
+
+    def encode(texts):
+        return model.encode(texts, batch_size=MAX_BATCH, normalize_embeddings=NORMALIZE_EMBEDDINGS).tolist()
+
+    batcher = DynamicBatcher(encode)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher, EMBEDDING_MODEL))
+    server.daemon_threads = True
+    print(f"Serving {EMBEDDING_MODEL} on {args.host}:{args.port} "
+          f"(batches of up to {MAX_BATCH} texts, {BATCH_WAIT_MS} ms wait)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
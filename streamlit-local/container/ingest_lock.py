@@ -0,0 +1,234 @@
+"""
+Locks that let exactly one app replica ingest at a time.
+
+Every replica runs ingestion on startup. The replica holding the lock builds
+the index; the others wait for it and then find their documents already
+ingested, so they only reuse the result. Try it locally with several
+processes against a lock file, or against Milvus:
+
+    python ingest_lock.py --processes 4 --lock file:/tmp/ingest.lock
+    python ingest_lock.py --processes 4 --lock milvus --host localhost
+"""
+import argparse
+import fcntl
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, MilvusException, connections, utility
+
+LOCK_COLLECTION = "ingest_lock"
+
+# A lease not renewed for LEASE_TTL seconds is considered abandoned. Contenders
+# wait SETTLE_SECONDS after announcing themselves so they all see each other
+# before deciding who goes first.
+LEASE_TTL = 60.0
+SETTLE_SECONDS = 2.0
+POLL_SECONDS = 2.0
+
+
+class LeaseLostError(Exception):
+    """The ingest lock expired while held, so another replica may be ingesting too."""
+
+
+class FileLock:
+    """Exclusive flock on a file, for replicas that share a volume. Released when the process dies."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def acquire(self, report=print):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "a")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            report("Waiting for another replica to finish ingesting...")
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def release(self):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+    def check(self):
+        """An flock is held until released or the process dies, so it cannot be lost."""
+
+
+class MilvusLease:
+    """
+    Lease record in a Milvus collection, for replicas that share nothing but Milvus.
+
+    Milvus has no compare-and-set, so a contender upserts its own request row,
+    waits SETTLE_SECONDS and reads all live requests with strong consistency;
+    the oldest request wins and everyone else withdraws and waits until no
+    live lease is left. The holder renews its lease in the background, so a
+    crashed replica blocks the others for at most LEASE_TTL seconds. Failed
+    renewals are retried until the lease runs out; from then on check()
+    raises, so the holder stops before writing over another replica's work.
+    """
+
+    def __init__(self, name: str = "ingest", ttl: float = LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.requested_at = None
+        self.expires_at = None
+        self.collection = None
+        self.stop = threading.Event()
+        self.lost = threading.Event()
+        self.heartbeat = None
+
+    def _open(self) -> Collection:
+        if not utility.has_collection(LOCK_COLLECTION):
+            schema = CollectionSchema([
+                FieldSchema("holder", DataType.VARCHAR, is_primary=True, max_length=255),
+                FieldSchema("name", DataType.VARCHAR, max_length=255),
+                FieldSchema("requested_at", DataType.DOUBLE),
+                FieldSchema("expires_at", DataType.DOUBLE),
+                FieldSchema("placeholder", DataType.FLOAT_VECTOR, dim=2),
+            ], description="Ingestion leases")
+            try:
+                collection = Collection(LOCK_COLLECTION, schema)
+                collection.create_index("placeholder", {"index_type": "FLAT", "metric_type": "L2", "params": {}})
+            except MilvusException:
+                pass  # Another replica created it first.
+        collection = Collection(LOCK_COLLECTION)
+        collection.load()
+        return collection
+
+    def _write(self):
+        expires_at = time.time() + self.ttl
+        self.collection.upsert([[self.holder], [self.name], [self.requested_at],
+                                [expires_at], [[0.0, 0.0]]])
+        self.expires_at = expires_at
+
+    def _withdraw(self):
+        self.collection.delete(f"holder in {json.dumps([self.holder])}")
+
+    def _live(self) -> list:
+        return self.collection.query(
+            expr=f"name == {json.dumps(self.name)} and expires_at > {time.time()}",
+            output_fields=["holder", "requested_at"],
+            consistency_level="Strong"
+        )
+
+    def _renew(self):
+        interval = self.ttl / 3
+        while not self.stop.wait(interval):
+            try:
+                self._write()
+                interval = self.ttl / 3
+            except Exception as e:
+                if time.time() >= self.expires_at:
+                    print(f"Ingest lease expired, could not renew it: {e}")
+                    self.lost.set()
+                    return
+                print(f"Could not renew ingest lease, retrying: {e}")
+                interval = POLL_SECONDS
+
+    def acquire(self, report=print):
+        self.collection = self._open()
+        waiting = False
+        while True:
+            if any(row["holder"] != self.holder for row in self._live()):
+                if not waiting:
+                    report("Waiting for another replica to finish ingesting...")
+                    waiting = True
+                time.sleep(POLL_SECONDS)
+                continue
+            self.requested_at = time.time()
+            self._write()
+            time.sleep(SETTLE_SECONDS)
+            winner = min(self._live(), key=lambda row: (row["requested_at"], row["holder"]), default=None)
+            if winner is not None and winner["holder"] == self.holder:
+                self.stop.clear()
+                self.lost.clear()
+                self.heartbeat = threading.Thread(target=self._renew, daemon=True)
+                self.heartbeat.start()
+                return
+            self._withdraw()
+
+    def release(self):
+        self.stop.set()
+        self.heartbeat.join()
+        self._withdraw()
+
+    def check(self):
+        """Raise LeaseLostError if the lease ran out while held."""
+        if self.lost.is_set():
+            raise LeaseLostError("Lost the ingest lease, another replica may have taken over")
+
+
+def ingest_lock(spec: str):
+    """Build a lock from a spec: "milvus", "file:<path>" or "none"."""
+    if spec == "none":
+        return None
+    if spec == "milvus":
+        return MilvusLease()
+    if spec.startswith("file:"):
+        return FileLock(spec[len("file:"):])
+    raise ValueError(f"Unsupported ingest lock {spec!r}, expected milvus, file:<path> or none")
+
+
+def _contend(spec: str, host: str, port: str, marker: str, work: float, results):
+    """One simulated replica: ingest unless another replica already did."""
+    if spec == "milvus":
+        connections.connect(host=host, port=port)
+    lock = ingest_lock(spec)
+    lock.acquire(report=lambda message: None)
+    try:
+        if os.path.exists(marker):
+            results.put((os.getpid(), "reused"))
+            return
+        time.sleep(work)
+        with open(marker, "w") as file:
+            file.write(str(os.getpid()))
+        results.put((os.getpid(), "ingested"))
+    finally:
+        lock.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that only one of several processes ingests")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--lock", default="file:/tmp/ingest.lock")
+    parser.add_argument("--host", default="milvus-service")
+    parser.add_argument("--port", default="19530")
+    parser.add_argument("--work", type=float, default=3.0, help="seconds the simulated ingestion takes")
+    args = parser.parse_args()
+
+    marker = f"/tmp/ingest-lock-demo-{uuid.uuid4().hex[:8]}"
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [context.Process(target=_contend, args=(args.lock, args.host, args.port, marker, args.work, results))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    outcomes = []
+    while True:
+        try:
+            outcomes.append(results.get(timeout=1))
+        except queue.Empty:
+            break
+    for pid, outcome in sorted(outcomes):
+        print(f"process {pid}: {outcome}")
+    ingested = sum(outcome == "ingested" for _, outcome in outcomes)
+    if ingested == 1 and len(outcomes) == len(processes):
+        print("OK: exactly one process ingested")
+    else:
+        print(f"FAILED: {ingested} of {len(processes)} processes ingested, {len(processes) - len(outcomes)} crashed")
+    if os.path.exists(marker):
+        os.remove(marker)
+
+
+if __name__ == "__main__":
+    main()
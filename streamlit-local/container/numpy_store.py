@@ -0,0 +1,394 @@
+import json
+import os
+import threading
+
+import numpy as np
+from langchain.docstore.document import Document
+
+# Initial number of vector rows allocated; the file doubles when it fills up.
+INITIAL_CAPACITY = 1024
+
+INDEX_TYPES = ("FLAT", "IVF")
+
+# Deleted rows are only marked in the log; once they make up this fraction of
+# the store it is rewritten without them.
+COMPACT_FRACTION = 0.3
+
+# IVF settings: below IVF_MIN_VECTORS the exact search is fast enough and the
+# index is not trained. The inverted lists are retrained once the store has
+# doubled since the last training so centroids keep up with the data.
+IVF_MIN_VECTORS = 4096
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 65536
+
+
+class JsonManifest:
+    """Ingestion manifest kept as a JSON file next to the vectors."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.entries = json.load(file)
+
+    def get(self, url: str) -> dict:
+        """Return the manifest entry for a document URL, or None."""
+        return self.entries.get(url)
+
+    def put(self, url: str, version: str, collection_name: str, chunk_count: int):
+        """Record that a document version is fully ingested."""
+        self.entries[url] = {"doc_version": version, "collection_name": collection_name,
+                             "chunk_count": chunk_count}
+        self._save()
+
+    def urls(self) -> list:
+        """Return the URL of every document in the manifest."""
+        return list(self.entries)
+
+    def remove(self, url: str):
+        """Forget a document that is no longer ingested."""
+        if self.entries.pop(url, None) is not None:
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.path)
+
+
+class NumpyVectorStore:
+    """
+    In-process vector store that stands in for Milvus in the local container.
+
+    Vectors live in a memory-mapped float32 file, so a restart maps the existing
+    index instead of re-embedding anything. Texts and metadata are kept in an
+    append-only JSON lines log that also records deletions. When deleted rows
+    pile up the vectors and log are rewritten as a new generation of files, so
+    the ids returned by stored_chunks are only valid until the next
+    delete_chunks call.
+
+    index_type "FLAT" scores every vector with one matrix product. "IVF" clusters
+    the vectors with k-means into nlist inverted lists and only scores the
+    nprobe lists closest to the query, trading a little recall for speed on
+    larger corpora. Scores are squared L2 distances like Milvus' default metric,
+    so lower is closer.
+    """
+
+    def __init__(self, embedding_function, directory: str, index_type: str = "FLAT",
+                 nlist: int = None, nprobe: int = 8):
+        if index_type.upper() not in INDEX_TYPES:
+            raise ValueError(f"Unsupported vector index type {index_type}, expected one of {', '.join(INDEX_TYPES)}")
+        self.embedding_function = embedding_function
+        self.directory = directory
+        self.index_type = index_type.upper()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.lock = threading.RLock()
+
+        self.generation = 0
+        self.vectors = None
+        self.dim = None
+        self.capacity = 0
+        self.count = 0
+        self.texts = []
+        self.metadatas = []
+        self.rows_by_hash = {}
+        self.live = np.zeros(0, dtype=bool)
+        self.sq_norms = np.zeros(0, dtype=np.float32)
+
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.lists = []
+        self.trained_count = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = JsonManifest(os.path.join(directory, "manifest.json"))
+        self._load()
+
+    def _path(self, name: str, extension: str, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        suffix = f".{generation}" if generation else ""
+        return os.path.join(self.directory, f"{name}{suffix}.{extension}")
+
+    @property
+    def _vectors_path(self) -> str:
+        return self._path("vectors", "f32")
+
+    @property
+    def _log_path(self) -> str:
+        return self._path("docs", "jsonl")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "store.json")
+
+    @property
+    def _ivf_path(self) -> str:
+        return self._path("ivf", "npz")
+
+    def _load(self):
+        """Map an existing store from disk."""
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as file:
+            meta = json.load(file)
+        self.generation = meta.get("generation", 0)
+        self._map(meta["dim"], meta["capacity"], "r+")
+
+        deleted = set()
+        with open(self._log_path) as file:
+            for line in file:
+                record = json.loads(line)
+                if "deleted" in record:
+                    deleted.update(record["deleted"])
+                else:
+                    self.texts.append(record["text"])
+                    self.metadatas.append(record["metadata"])
+        # Rows written after the last complete log record are ignored.
+        self.count = len(self.texts)
+        self.live = np.ones(self.count, dtype=bool)
+        self.live[[i for i in deleted if i < self.count]] = False
+        self.rows_by_hash = {meta["chunk_hash"]: i for i, meta in enumerate(self.metadatas)
+                             if self.live[i] and "chunk_hash" in meta}
+        self.sq_norms = np.einsum("ij,ij->i", self.vectors[:self.count], self.vectors[:self.count])
+
+        if self.index_type == "IVF" and os.path.exists(self._ivf_path):
+            ivf = np.load(self._ivf_path)
+            self.centroids = ivf["centroids"]
+            self.trained_count = int(ivf["trained_count"])
+            self.assignments = ivf["assignments"][:self.count]
+            if len(self.assignments) < self.count:
+                self._assign(len(self.assignments), self.count)
+            self._build_lists()
+
+    def _map(self, dim: int, capacity: int, mode: str):
+        self.dim = dim
+        self.capacity = capacity
+        self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+
+    def _grow(self, needed: int):
+        """Make room for needed rows, doubling the backing file."""
+        if self.vectors is not None and needed <= self.capacity:
+            return
+        capacity = max(INITIAL_CAPACITY, self.capacity * 2, needed)
+        if self.vectors is None:
+            self._map(self.dim, capacity, "w+")
+        else:
+            self.vectors.flush()
+            self.vectors = None
+            with open(self._vectors_path, "r+b") as file:
+                file.truncate(capacity * self.dim * 4)
+            self._map(self.dim, capacity, "r+")
+        self._save_meta()
+
+    def _save_meta(self):
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"dim": self.dim, "capacity": self.capacity, "generation": self.generation}, file)
+        os.replace(tmp_path, self._meta_path)
+
+    def has_data(self) -> bool:
+        return bool(self.live.any())
+
+    def add_documents(self, documents: list) -> list:
+        """Embed and store documents, returning their ids."""
+        texts = [doc.page_content for doc in documents]
+        embeddings = np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32)
+        with self.lock:
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+            start, stop = self.count, self.count + len(documents)
+            self._grow(stop)
+            self.vectors[start:stop] = embeddings
+            self.vectors.flush()
+            with open(self._log_path, "a") as file:
+                for doc in documents:
+                    file.write(json.dumps({"text": doc.page_content, "metadata": doc.metadata}) + "\n")
+
+            self.texts.extend(texts)
+            self.metadatas.extend(doc.metadata for doc in documents)
+            self.rows_by_hash.update((doc.metadata["chunk_hash"], start + i) for i, doc in enumerate(documents)
+                                     if "chunk_hash" in doc.metadata)
+            self.live = np.concatenate([self.live, np.ones(len(documents), dtype=bool)])
+            self.sq_norms = np.concatenate([self.sq_norms, np.einsum("ij,ij->i", embeddings, embeddings)])
+            self.count = stop
+
+            if self.index_type == "IVF":
+                if self.centroids is None or self.count >= 2 * self.trained_count:
+                    self._train()
+                else:
+                    self._assign(start, stop)
+                    self._build_lists()
+                self._save_ivf()
+            return list(range(start, stop))
+
+    def stored_chunks(self, url: str) -> dict:
+        """Map chunk hash to id for every stored chunk of a document."""
+        with self.lock:
+            return {meta["chunk_hash"]: i for i, meta in enumerate(self.metadatas)
+                    if self.live[i] and meta.get("doc_url") == url}
+
+    def iter_chunks(self, url: str):
+        """Yield every stored chunk of a document without its vector."""
+        with self.lock:
+            chunks = [(self.texts[i], self.metadatas[i]) for i in range(self.count)
+                      if self.live[i] and self.metadatas[i].get("doc_url") == url]
+        for text, metadata in chunks:
+            yield Document(page_content=text, metadata=dict(metadata))
+
+    def delete_chunks(self, ids: list):
+        with self.lock:
+            self.live[ids] = False
+            for i in ids:
+                if self.rows_by_hash.get(self.metadatas[i].get("chunk_hash")) == i:
+                    del self.rows_by_hash[self.metadatas[i]["chunk_hash"]]
+            with open(self._log_path, "a") as file:
+                file.write(json.dumps({"deleted": list(ids)}) + "\n")
+            if self.count - np.count_nonzero(self.live) >= COMPACT_FRACTION * self.count:
+                self._compact()
+
+    def _compact(self):
+        """
+        Rewrite the live rows into a new generation of vector and log files.
+        Switching store.json to the new generation is the commit point, so a
+        crash at any step leaves either the old or the new files in use.
+        """
+        rows = np.flatnonzero(self.live)
+        generation = self.generation + 1
+        capacity = max(INITIAL_CAPACITY, len(rows))
+        vectors = np.memmap(self._path("vectors", "f32", generation), dtype=np.float32, mode="w+",
+                            shape=(capacity, self.dim))
+        for start in range(0, len(rows), INITIAL_CAPACITY):
+            block = rows[start:start + INITIAL_CAPACITY]
+            vectors[start:start + len(block)] = self.vectors[block]
+        vectors.flush()
+        texts = [self.texts[i] for i in rows]
+        metadatas = [self.metadatas[i] for i in rows]
+        with open(self._path("docs", "jsonl", generation), "w") as file:
+            for text, metadata in zip(texts, metadatas):
+                file.write(json.dumps({"text": text, "metadata": metadata}) + "\n")
+
+        old_paths = [self._vectors_path, self._log_path, self._ivf_path]
+        self.generation = generation
+        self.vectors = vectors
+        self.capacity = capacity
+        self._save_meta()
+        for path in old_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+        self.count = len(rows)
+        self.texts = texts
+        self.metadatas = metadatas
+        self.live = np.ones(self.count, dtype=bool)
+        self.sq_norms = self.sq_norms[rows]
+        self.rows_by_hash = {meta["chunk_hash"]: i for i, meta in enumerate(metadatas) if "chunk_hash" in meta}
+        if self.centroids is not None:
+            self.assignments = self.assignments[rows]
+            self.trained_count = min(self.trained_count, self.count)
+            self._build_lists()
+            self._save_ivf()
+
+    def chunk_vectors(self, hashes: list) -> dict:
+        """Map chunk hash to stored embedding for the given chunks."""
+        with self.lock:
+            return {key: np.array(self.vectors[self.rows_by_hash[key]]) for key in hashes if key in self.rows_by_hash}
+
+    def _train(self):
+        """Cluster the live vectors into inverted lists with k-means."""
+        if self.count < IVF_MIN_VECTORS:
+            self.centroids = None
+            return
+        data = self.vectors[:self.count][self.live]
+        nlist = min(self.nlist or int(np.sqrt(len(data))), len(data))
+        rng = np.random.default_rng(0)
+        if len(data) > KMEANS_SAMPLE:
+            data = data[rng.choice(len(data), KMEANS_SAMPLE, replace=False)]
+        centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = self._nearest_centroid(data, centroids)
+            for c in range(nlist):
+                members = data[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        self.centroids = centroids
+        self.trained_count = self.count
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self._assign(0, self.count)
+        self._build_lists()
+
+    @staticmethod
+    def _nearest_centroid(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2 * data @ centroids.T)
+        return np.argmin(distances, axis=1).astype(np.int32)
+
+    def _assign(self, start: int, stop: int):
+        if self.centroids is None:
+            return
+        labels = self._nearest_centroid(self.vectors[start:stop], self.centroids)
+        self.assignments = np.concatenate([self.assignments, labels])
+
+    def _build_lists(self):
+        if self.centroids is None:
+            return
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+    def _save_ivf(self):
+        if self.centroids is None:
+            return
+        np.savez(self._ivf_path, centroids=self.centroids, assignments=self.assignments,
+                 trained_count=self.trained_count)
+
+    def _probe(self, query: np.ndarray) -> np.ndarray:
+        """Row ids in the nprobe inverted lists closest to the query."""
+        centroid_distances = np.einsum("ij,ij->i", self.centroids, self.centroids) - 2 * self.centroids @ query
+        probes = np.argsort(centroid_distances)[:self.nprobe]
+        return np.concatenate([self.lists[c] for c in probes])
+
+    def _source_rows(self, sources: list) -> np.ndarray:
+        """Row ids of the live chunks of the given source documents."""
+        sources = set(sources)
+        return np.asarray([i for i, meta in enumerate(self.metadatas)
+                           if self.live[i] and meta.get("doc_url") in sources], dtype=np.int64)
+
+    def similarity_search_with_score_by_vector(self, embedding: list, k: int = 4, sources: list = None,
+                                                **kwargs) -> list:
+        """Return the k closest (Document, score) pairs to an embedding, optionally only from sources."""
+        query = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            if not self.count:
+                return []
+            if sources:
+                # Scoped search is exact over the selected documents only.
+                candidates = self._source_rows(sources)
+                distances = self.sq_norms[candidates] - 2 * (self.vectors[candidates] @ query) + query @ query
+            elif self.index_type == "IVF" and self.centroids is not None:
+                candidates = self._probe(query)
+                candidates = candidates[self.live[candidates]]
+                distances = self.sq_norms[candidates] - 2 * (self.vectors[candidates] @ query) + query @ query
+            else:
+                # Exact search: one matrix product over the mapped rows, no copy.
+                candidates = np.flatnonzero(self.live)
+                distances = self.sq_norms - 2 * (self.vectors[:self.count] @ query) + query @ query
+                distances = distances[candidates]
+            if not len(candidates):
+                return []
+            k = min(k, len(candidates))
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top])]
+            return [(Document(page_content=self.texts[candidates[i]], metadata=dict(self.metadatas[candidates[i]])),
+                     float(distances[i])) for i in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        """Return the k closest (Document, score) pairs to a query string."""
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k, **kwargs)
+
+
+def open_numpy_store(embeddings, directory: str, index_type: str = "FLAT", nlist: int = None, nprobe: int = 8):
+    """Open the local vector store and its manifest for sync_documents."""
+    vector_store = NumpyVectorStore(embeddings, directory, index_type, nlist, nprobe)
+    return vector_store, vector_store.manifest
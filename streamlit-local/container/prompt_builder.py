@@ -0,0 +1,140 @@
+import math
+import re
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from llama_client import LlamaClientError
+
+INSTRUCTIONS = ("Instructions: Compose a concise answer to the query using the provided search results, "
+                "no need to mention you found it in the resuts\n\n")
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Headroom for tokens the per-piece counts miss: BOS and merges across the
+# boundaries of separately tokenized pieces.
+TOKEN_MARGIN = 16
+
+# Characters per token assumed when the tokenizer cannot be reached. Lower than
+# the usual ~4 so the estimate errs towards a shorter prompt.
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def token_counter(client):
+    """Count tokens with the llama.cpp tokenizer, estimating from length when it is unavailable."""
+    def count_tokens(texts: list) -> list:
+        if not texts:
+            return []
+        try:
+            return client.count_tokens(texts)
+        except LlamaClientError as e:
+            print(f"Tokenizer unavailable, estimating prompt size: {e}")
+            return [estimate_tokens(text) for text in texts]
+    return count_tokens
+
+
+def chunk_header(doc) -> str:
+    return f"[Document: {doc.metadata.get('source', 'Unknown')}, Page: {doc.metadata.get('page', 'Unknown')}]: "
+
+
+def split_sentences(text: str) -> list:
+    return [sentence for sentence in SENTENCE_END.split(text) if sentence]
+
+
+def compress_context(question_vector, topn_chunks: list, embeddings, count_tokens, budget: int) -> list:
+    """
+    Keep only the sentences of the retrieved chunks that matter for the question.
+
+    Every distinct sentence is embedded once with the document embedding
+    model and scored by cosine similarity to the question vector. Pass the
+    model itself rather than CachedEmbeddings: these one-off sentence vectors
+    would only evict chunk vectors from the cache. The best sentences are
+    kept until their token count reaches budget; each chunk keeps its
+    surviving sentences in their original order under its own metadata, so
+    citations still name the right document and page. Chunks left without a
+    sentence are dropped.
+
+    Only whole chunks are sent to the tokenizer; a sentence is charged its
+    chunk's tokens in proportion to its length. build_prompt counts the
+    exact size of the final prompt.
+    """
+    texts = [doc.page_content.replace("\n", " ") for doc, _ in topn_chunks]
+    sentences, owners = [], []
+    for i, text in enumerate(texts):
+        for sentence in split_sentences(text):
+            sentences.append(sentence)
+            owners.append(i)
+    if not sentences:
+        return topn_chunks
+
+    unique = list(dict.fromkeys(sentences))
+    vectors = np.asarray(embeddings.embed_documents(unique), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(question_vector, dtype=np.float32)
+    unique_scores = dict(zip(unique, vectors @ (query / max(np.linalg.norm(query), 1e-12))))
+    scores = np.asarray([unique_scores[sentence] for sentence in sentences])
+    chunk_tokens = count_tokens(texts)
+    tokens = [math.ceil(chunk_tokens[owner] * len(sentence) / max(len(texts[owner]), 1))
+              for sentence, owner in zip(sentences, owners)]
+
+    kept = set()
+    used = 0
+    for i in np.argsort(-scores):
+        if used + tokens[i] > budget and kept:
+            continue
+        kept.add(int(i))
+        used += tokens[i]
+
+    compressed = []
+    for owner, (doc, score) in enumerate(topn_chunks):
+        text = " ".join(sentence for i, sentence in enumerate(sentences) if owners[i] == owner and i in kept)
+        if text:
+            compressed.append((Document(page_content=text, metadata=dict(doc.metadata)), score))
+    return compressed
+
+
+def build_prompt(question: str, topn_chunks: list, count_tokens, budget: int):
+    """
+    Assemble the RAG prompt within a token budget.
+
+    topn_chunks are (Document, score) pairs, best first. Chunks are added in
+    that order while they fit; the first one that does not fit is cut at the
+    last sentence boundary that still fits, and assembly stops there.
+    count_tokens maps a list of strings to their token counts, e.g.
+    token_counter(get_llama_client(...)).
+
+    Returns the prompt and its token count.
+    """
+    head = INSTRUCTIONS + "Search results:\n"
+    tail = f"Query: {question}\n\nAnswer: "
+    texts = [chunk[0].page_content.replace("\n", " ") for chunk in topn_chunks]
+    headers = [chunk_header(chunk[0]) for chunk in topn_chunks]
+    entries = [header + text + "\n\n" for header, text in zip(headers, texts)]
+
+    head_tokens, tail_tokens, *entry_tokens = count_tokens([head, tail, *entries])
+    remaining = budget - TOKEN_MARGIN - head_tokens - tail_tokens
+    selected = []
+    for i, entry in enumerate(entries):
+        if entry_tokens[i] <= remaining:
+            selected.append(entry)
+            remaining -= entry_tokens[i]
+            continue
+        sentences = split_sentences(texts[i])
+        header_tokens, *sentence_tokens = count_tokens([headers[i] + "\n\n", *sentences])
+        remaining -= header_tokens
+        kept = []
+        for sentence, tokens in zip(sentences, sentence_tokens):
+            if tokens + 1 > remaining:
+                break
+            kept.append(sentence)
+            remaining -= tokens + 1
+        if kept:
+            selected.append(headers[i] + " ".join(kept) + "\n\n")
+        break
+
+    prompt = head + "".join(selected) + tail
+    return prompt, count_tokens([prompt])[0]
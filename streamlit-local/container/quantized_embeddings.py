@@ -0,0 +1,237 @@
+"""
+int8 CPU backends for the all-MiniLM-L6-v2 sentence embeddings.
+
+"onnx-int8" exports the cached sentence-transformers weights to ONNX once,
+applies onnxruntime dynamic int8 quantization to the weights and runs the
+quantized graph with onnxruntime. "torch-int8" applies PyTorch dynamic
+quantization to the Linear layers in place, for platforms without an
+onnxruntime build; it needs a PyTorch quantized engine (fbgemm, x86, onednn
+or qnnpack), which is checked when the backend is loaded. onnxruntime is
+only imported when onnx-int8 is used.
+Both reproduce the model's mean pooling and normalization, so their vectors
+can stand in for the fp32 ones.
+
+Check recall against fp32 and measure throughput on real documents before
+switching a deployment over:
+
+    python quantized_embeddings.py --backend onnx-int8 --tolerance 0.05 \
+        https://github.com/DanielCasali/mma-ai/raw/main/datasource/The_Forgotten_Lighthouse_Book.pdf
+
+Exits non-zero when recall@k drops by more than the tolerance.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+BACKENDS = ("hf", "onnx-int8", "torch-int8")
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "/.cache/onnx")
+
+# MiniLM was trained on up to 256 word pieces, like sentence-transformers' max_seq_length.
+MAX_SEQ_LENGTH = 256
+BATCH_SIZE = 32
+
+
+def _model_path(model_name: str, cache_folder: str = None) -> str:
+    """Local snapshot of a Hugging Face model, preferring the files already cached."""
+    from huggingface_hub import snapshot_download
+    try:
+        return snapshot_download(model_name, cache_dir=cache_folder, local_files_only=True)
+    except Exception:
+        return snapshot_download(model_name, cache_dir=cache_folder)
+
+
+def _mean_pool(hidden: np.ndarray, mask: np.ndarray, normalize: bool) -> np.ndarray:
+    mask = mask[..., None].astype(np.float32)
+    vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    if normalize:
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return vectors
+
+
+def export_onnx_int8(model_name: str, cache_folder: str = None, output_dir: str = ONNX_CACHE_DIR) -> str:
+    """Export the transformer to ONNX and quantize its weights to int8, reusing an earlier export."""
+    directory = os.path.join(output_dir, model_name.replace("/", "--"))
+    int8_path = os.path.join(directory, "model.int8.onnx")
+    if os.path.exists(int8_path):
+        return int8_path
+
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(directory, exist_ok=True)
+    path = _model_path(model_name, cache_folder)
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    model = AutoModel.from_pretrained(path).eval()
+    sample = tokenizer(["export"], return_tensors="pt")
+    fp32_path = os.path.join(directory, "model.onnx")
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]), fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "token_type_ids": axes,
+                          "last_hidden_state": axes},
+            opset_version=14,
+        )
+    tmp_path = int8_path + ".tmp"
+    quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, int8_path)
+    os.remove(fp32_path)
+    return int8_path
+
+
+class OnnxInt8Embeddings(Embeddings):
+    """Sentence embeddings from the int8 ONNX export of a sentence-transformers model."""
+
+    def __init__(self, model_name: str, cache_folder: str = None, normalize: bool = True, threads: int = None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError(f"The onnx-int8 embedding backend needs the onnx and onnxruntime packages: {e}") from e
+        from transformers import AutoTokenizer
+
+        self.normalize = normalize
+        self.tokenizer = AutoTokenizer.from_pretrained(_model_path(model_name, cache_folder))
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        self.session = onnxruntime.InferenceSession(export_onnx_int8(model_name, cache_folder), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {graph_input.name for graph_input in self.session.get_inputs()}
+
+    def _encode(self, texts: list) -> np.ndarray:
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np")
+        inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(None, inputs)[0]
+        return _mean_pool(hidden, encoded["attention_mask"], self.normalize)
+
+    def embed_documents(self, texts: list) -> list:
+        # Similar lengths share a batch so little compute goes to padding.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), BATCH_SIZE):
+            batch = order[start:start + BATCH_SIZE]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self._encode([text])[0].tolist()
+
+
+def select_quantized_engine() -> str:
+    """
+    Make PyTorch run int8 layers on a quantized engine this build supports.
+
+    Raises RuntimeError when there is none, as on some ppc64le builds, rather
+    than failing on the first embedding.
+    """
+    import torch
+
+    engines = [engine for engine in torch.backends.quantized.supported_engines if engine != "none"]
+    if not engines:
+        raise RuntimeError("The torch-int8 embedding backend needs a PyTorch quantized engine (fbgemm, x86, onednn "
+                           "or qnnpack) and this PyTorch build has none; use EMBEDDING_BACKEND=onnx-int8 or hf")
+    if torch.backends.quantized.engine not in engines:
+        torch.backends.quantized.engine = engines[0]
+    return torch.backends.quantized.engine
+
+
+class TorchInt8Embeddings(Embeddings):
+    """Sentence embeddings from a sentence-transformers model with dynamically quantized Linear layers."""
+
+    def __init__(self, model_name: str, cache_folder: str = None, normalize: bool = True):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        engine = select_quantized_engine()
+        self.normalize = normalize
+        self.model = SentenceTransformer(model_name, cache_folder=cache_folder, device="cpu")
+        self.model[0].auto_model = torch.quantization.quantize_dynamic(
+            self.model[0].auto_model, {torch.nn.Linear}, dtype=torch.qint8)
+        try:
+            self.embed_query("quantized engine check")
+        except RuntimeError as e:
+            raise RuntimeError(f"The torch-int8 embedding backend fails on the {engine} quantized engine: {e}") from e
+
+    def embed_documents(self, texts: list) -> list:
+        return self.model.encode(texts, batch_size=BATCH_SIZE, normalize_embeddings=self.normalize).tolist()
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+def load_quantized_embeddings(backend: str, model_name: str, cache_folder: str = None, normalize: bool = True):
+    """Embeddings for an int8 backend name."""
+    if backend == "onnx-int8":
+        return OnnxInt8Embeddings(model_name, cache_folder, normalize)
+    if backend == "torch-int8":
+        return TorchInt8Embeddings(model_name, cache_folder, normalize)
+    raise ValueError(f"Unsupported embedding backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+def _throughput(embeddings: Embeddings, texts: list):
+    embeddings.embed_documents(texts[:BATCH_SIZE])  # Warm up before timing
+    started = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    return vectors, len(texts) / (time.perf_counter() - started)
+
+
+def _recall(reference: np.ndarray, candidate: np.ndarray, queries: np.ndarray, candidate_queries: np.ndarray,
+            k: int) -> float:
+    """Share of the fp32 top-k chunks the int8 vectors also rank in their top-k."""
+    def top_k(vectors, query_vectors):
+        return np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :k]
+    expected, found = top_k(reference, queries), top_k(candidate, candidate_queries)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, found)]))
+
+
+def main():
+    from langchain.embeddings import HuggingFaceEmbeddings
+    from ingest import fetch_document, iter_pdf_chunks
+
+    parser = argparse.ArgumentParser(description="Recall and throughput of an int8 embedding backend against fp32")
+    parser.add_argument("documents", nargs="+", help="PDF URLs or paths")
+    parser.add_argument("--backend", default="onnx-int8", choices=BACKENDS[1:])
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--cache-folder", default="/work/")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--tolerance", type=float, default=0.05, help="allowed drop in recall@k")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = []
+    for source in args.documents:
+        path, _ = fetch_document(source)
+        texts.extend(doc.page_content for doc in iter_pdf_chunks(path, source))
+    rng = np.random.default_rng(args.seed)
+    # The first sentence of a chunk stands in for a question about it.
+    query_texts = [texts[i].split(". ")[0] for i in rng.choice(len(texts), min(args.queries, len(texts)), replace=False)]
+
+    fp32 = HuggingFaceEmbeddings(model_name=args.model, cache_folder=args.cache_folder,
+                                 model_kwargs={"device": "cpu"}, encode_kwargs={"normalize_embeddings": True})
+    int8 = load_quantized_embeddings(args.backend, args.model, args.cache_folder)
+    reference, fp32_rate = _throughput(fp32, texts)
+    candidate, int8_rate = _throughput(int8, texts)
+    recall = _recall(reference, candidate, np.asarray(fp32.embed_documents(query_texts), dtype=np.float32),
+                     np.asarray(int8.embed_documents(query_texts), dtype=np.float32), args.k)
+    cosine = float(np.mean(np.sum(reference * candidate, axis=1)))
+
+    print(f"{len(texts)} chunks from {len(args.documents)} documents, {len(query_texts)} queries, k={args.k}")
+    print(f"fp32 (hf):      {fp32_rate:8.1f} docs/sec")
+    print(f"{args.backend + ':':15} {int8_rate:8.1f} docs/sec ({int8_rate / fp32_rate:.2f}x)")
+    print(f"recall@{args.k} vs fp32: {recall:.3f}, mean cosine to fp32 vectors: {cosine:.4f}")
+    if recall < 1 - args.tolerance:
+        print(f"FAILED: recall below {1 - args.tolerance:.3f}")
+        sys.exit(1)
+    print(f"OK: recall within tolerance {args.tolerance}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import numpy as np
+
+
+def _chunk_key(doc) -> str:
+    return doc.metadata.get("chunk_hash") or doc.page_content
+
+
+def reciprocal_rank_fusion(result_lists: list, k: int = None, rrf_k: int = 60) -> list:
+    """
+    Merge ranked (Document, score) lists by reciprocal rank fusion.
+
+    Each list contributes 1 / (rrf_k + rank) per chunk, so chunks ranked well by
+    several retrievers rise to the top regardless of how each scores. Returns
+    the k best (Document, fused score) pairs, or all of them with k None,
+    higher is better.
+    """
+    fused = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            key = _chunk_key(doc)
+            if key not in fused:
+                fused[key] = [doc, 0.0]
+            fused[key][1] += 1.0 / (rrf_k + rank)
+    ranked = sorted(fused.values(), key=lambda item: item[1], reverse=True)
+    return [(doc, score) for doc, score in ranked[:k]]
+
+
+def hybrid_search(vector_store, sparse_index, question: str, question_vector: list, k: int = 3,
+                  candidates: int = 10, rrf_k: int = 60, sources: list = None) -> list:
+    """
+    Retrieve chunks with dense and BM25 search and fuse the rankings.
+
+    Dense search finds paraphrases, BM25 finds exact names and numbers; fusing
+    both lets a small k carry the right chunks. The vector distance of chunks
+    found by dense search is kept in metadata["vector_score"]. sources limits
+    both searches to the chunks of the given document URLs.
+    """
+    dense = vector_store.similarity_search_with_score_by_vector(question_vector, k=candidates, sources=sources)
+    for doc, score in dense:
+        doc.metadata["vector_score"] = score
+    sparse = sparse_index.search(question, k=candidates, sources=sources) if sparse_index is not None else []
+    return reciprocal_rank_fusion([dense, sparse], k, rrf_k)
+
+
+def vector_similarity(distance: float) -> float:
+    """Cosine similarity from the squared L2 distance between unit vectors (MiniLM normalizes its output)."""
+    return 1.0 - distance / 2.0
+
+
+def depth_limit(similarities: list, base_k: int, max_k: int, weak: float) -> int:
+    """Most chunks worth sending: base_k after a strong top result, max_k after a weak one."""
+    return base_k if not similarities or similarities[0] >= weak else max_k
+
+
+def retrieval_depth(similarities: list, base_k: int, max_k: int, floor: float, gap: float, weak: float) -> int:
+    """
+    Number of chunks worth sending, from vector similarities sorted best first.
+
+    A strong top result limits the search to base_k chunks, a weak one (below
+    weak) widens it to max_k. Within that limit chunks are taken until one
+    falls below floor or trails the previous one by more than gap.
+    """
+    if not similarities:
+        return base_k
+    limit = depth_limit(similarities, base_k, max_k, weak)
+    depth = 1
+    for previous, current in zip(similarities, similarities[1:limit]):
+        if current < floor or previous - current > gap:
+            break
+        depth += 1
+    return depth
+
+
+def mmr_rerank(query_vector, vectors, k: int, lambda_mult: float = 0.5) -> list:
+    """
+    Order candidates by maximal marginal relevance and return the first k indices.
+
+    Each step picks the candidate maximizing
+    lambda_mult * sim(query, c) - (1 - lambda_mult) * max sim(c, already picked),
+    with cosine similarities from one matrix product. lambda_mult 1 is plain
+    relevance order, lower values push near-duplicates of picked chunks down.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+
+    k = min(k, len(vectors))
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        np.maximum(redundancy, pairwise[pick], out=redundancy)
+    return selected
+
+
+def diversify(vector_store, question_vector, results: list, lambda_mult: float = 0.5) -> list:
+    """
+    Re-rank (Document, score) pairs by MMR over their stored embeddings.
+
+    Chunks whose embedding is not found in the store keep their place after
+    the re-ranked ones. Cutting the result short drops near-duplicates of the
+    chunks before the cut in favour of different ones.
+    """
+    vectors = vector_store.chunk_vectors([doc.metadata["chunk_hash"] for doc, _ in results
+                                          if "chunk_hash" in doc.metadata])
+    known = [item for item in results if item[0].metadata.get("chunk_hash") in vectors]
+    unknown = [item for item in results if item[0].metadata.get("chunk_hash") not in vectors]
+    if len(known) < 2:
+        return known + unknown
+    order = mmr_rerank(question_vector, [vectors[doc.metadata["chunk_hash"]] for doc, _ in known], len(known),
+                       lambda_mult)
+    return [known[i] for i in order] + unknown
+
+
+def adaptive_search(vector_store, sparse_index, question: str, question_vector: list, base_k: int = 3,
+                    max_k: int = 6, candidates: int = 10, rrf_k: int = 60, floor: float = 0.3,
+                    gap: float = 0.1, weak: float = 0.5, mmr_lambda: float = None, sources: list = None) -> list:
+    """
+    Hybrid search whose depth follows the vector scores instead of a fixed k.
+
+    Easy questions with one clearly matching chunk get just that chunk, vague
+    ones get up to max_k. Which chunks found by vector search are sent is
+    decided on their own similarities: the best ones down to the relevance
+    floor or the first large gap. Keyword-only matches fill the room left
+    under the depth limit. The chunks sent are ordered by fused rank.
+
+    With mmr_lambda set, the same number of chunks is instead taken in MMR
+    order from every candidate that clears the floor, so a near-duplicate of
+    a better chunk gives up its slot to a different one.
+    """
+    fused = hybrid_search(vector_store, sparse_index, question, question_vector, k=None,
+                          candidates=max(candidates, max_k), rrf_k=rrf_k, sources=sources)
+    by_similarity = sorted((doc for doc, _ in fused if "vector_score" in doc.metadata),
+                           key=lambda doc: doc.metadata["vector_score"])
+    similarities = [vector_similarity(doc.metadata["vector_score"]) for doc in by_similarity]
+    depth = retrieval_depth(similarities, base_k, max_k, floor, gap, weak)
+    selected = {_chunk_key(doc) for doc, similarity in zip(by_similarity[:depth], similarities) if similarity >= floor}
+    room = depth_limit(similarities, base_k, max_k, weak) - len(selected)
+    keyword_only = [_chunk_key(doc) for doc, _ in fused if "vector_score" not in doc.metadata]
+    selected.update(keyword_only[:max(room, 0)])
+    if mmr_lambda is not None and selected:
+        pool = [(doc, score) for doc, score in fused if "vector_score" not in doc.metadata
+                or vector_similarity(doc.metadata["vector_score"]) >= floor]
+        return diversify(vector_store, question_vector, pool, mmr_lambda)[:len(selected)]
+    relevant = [(doc, score) for doc, score in fused if _chunk_key(doc) in selected]
+    return relevant or fused[:1]
@@ -0,0 +1,49 @@
+import random
+import time
+
+import httpx
+from langchain.embeddings.base import Embeddings
+
+# Texts per request; the server splits or merges them into its own batches.
+REQUEST_BATCH_SIZE = 256
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+
+
+class RemoteEmbeddings(Embeddings):
+    """
+    Embeddings computed by embedding_server.py instead of an in-process model.
+
+    Drop-in replacement for HuggingFaceEmbeddings in Milvus, the caches and
+    the retrieval code. Connections are pooled and kept alive; transport
+    errors and 5xx responses are retried with jittered backoff.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 60):
+        self.base_url = base_url.rstrip("/")
+        self.client = httpx.Client(base_url=self.base_url, timeout=httpx.Timeout(timeout, connect=5),
+                                   limits=httpx.Limits(max_connections=16, max_keepalive_connections=16))
+
+    def _embed(self, texts: list) -> list:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = self.client.post("/embed", json={"texts": texts})
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()["embeddings"]
+                error = httpx.HTTPStatusError(f"Embedding server returned {response.status_code}",
+                                              request=response.request, response=response)
+            except httpx.TransportError as e:
+                error = e
+            if attempt >= MAX_RETRIES:
+                raise error
+            time.sleep(BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1.0))
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = []
+        for start in range(0, len(texts), REQUEST_BATCH_SIZE):
+            vectors.extend(self._embed(texts[start:start + REQUEST_BATCH_SIZE]))
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self._embed([text])[0]
@@ -0,0 +1,876 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+from langchain.docstore.document import Document
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.vectorstores import Milvus
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, MilvusException, utility
+from pypdf import PdfReader
+
+# Metadata stored with every chunk. Milvus derives the collection schema from the
+# first inserted document, so every chunk must carry exactly these keys.
+CHUNK_METADATA_FIELDS = ["source", "page", "doc_url", "chunk_hash"]
+
+MANIFEST_COLLECTION = "ingest_manifest"
+
+# Pages handed to a parser process at a time. Each task opens the PDF once, so
+# larger ranges amortize that cost while smaller ones balance load better.
+PAGES_PER_TASK = 8
+
+# Chunks embedded and inserted per vector store write, overridable with INGEST_BATCH_SIZE.
+INSERT_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+# Documents downloaded at the same time, and retries of a broken transfer.
+# Each retry resumes from the bytes already on disk.
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BLOCK_SIZE = 1 << 16
+
+# Batches parsed ahead of the embedder. Bounds memory to a few batches no
+# matter how large the document is.
+PREFETCH_BATCHES = 2
+
+
+def config_fingerprint(config: dict) -> str:
+    """Stable hash of the chunker and embedding settings that shape the stored vectors."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """Hash a downloaded document without reading it into memory at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def document_version(url: str, content_hash: str, config_hash: str) -> str:
+    """Identify one ingested revision of a document: URL + content + pipeline config."""
+    return hashlib.sha256(f"{url}\n{content_hash}\n{config_hash}".encode("utf-8")).hexdigest()
+
+
+def chunk_hash(url: str, page, text: str) -> str:
+    """Identify a chunk by where it came from and what it says."""
+    return hashlib.sha256(f"{url}\n{page}\n{text}".encode("utf-8")).hexdigest()
+
+
+def pdf_name_from_url(url: str) -> str:
+    """Get the file name part of a document URL."""
+    return os.path.basename(urllib.parse.urlparse(url).path)
+
+
+def download_name(url: str) -> str:
+    """Local file name of a downloaded document, unique per URL and still readable."""
+    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    name = pdf_name_from_url(url)
+    return f"{digest}-{name}" if name else digest
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def document_sources(urls: str = "", directory: str = "") -> list:
+    """
+    The documents to ingest: URLs or local paths separated by commas or
+    whitespace, followed by every PDF in directory.
+    """
+    sources = [source for source in urls.replace(",", " ").split() if source]
+    if directory:
+        sources += sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                          if name.lower().endswith(".pdf"))
+    return list(dict.fromkeys(sources))
+
+
+def fetch_document(source: str, directory: str = "/tmp/") -> tuple:
+    """Return (local path, content sha256) of a document URL or local path, downloading URLs."""
+    if urllib.parse.urlparse(source).scheme in ("http", "https"):
+        return download_pdf(source, directory)
+    path = urllib.parse.urlparse(source).path if source.startswith("file://") else source
+    return path, file_sha256(path)
+
+
+def download_pdf(url: str, directory: str = "/tmp/") -> tuple:
+    """
+    Download a document into directory and return (local path, content sha256).
+
+    The body is streamed to a .part file in blocks and renamed into place when
+    complete. A file downloaded before is revalidated with its ETag and
+    Last-Modified, so an unchanged document costs one 304 round trip and no
+    re-hashing. A broken transfer is resumed with a Range request guarded by
+    If-Range; if the server's copy changed meanwhile it sends the whole file.
+    """
+    path = os.path.join(directory, download_name(url))
+    part_path = path + ".part"
+    meta_path = path + ".json"
+    meta = _read_json(meta_path)
+    if meta.get("url") != url:
+        meta = {}
+
+    with requests.Session() as session:
+        for attempt in itertools.count():
+            headers = {}
+            if meta.get("sha256") and os.path.exists(path):
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+            partial = meta.get("partial") or {}
+            offset = os.path.getsize(part_path) if partial and os.path.exists(part_path) else 0
+            if offset and (partial.get("etag") or partial.get("last_modified")):
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = partial.get("etag") or partial["last_modified"]
+            else:
+                offset = 0
+
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+                    if response.status_code == 304:
+                        return path, meta["sha256"]
+                    if response.status_code == 416:
+                        # The partial file is no prefix of the current document.
+                        meta.pop("partial", None)
+                        os.remove(part_path)
+                        continue
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        offset = 0
+                    meta = {"url": url, "partial": {"etag": response.headers.get("ETag"),
+                                                    "last_modified": response.headers.get("Last-Modified")}}
+                    _write_json(meta_path, meta)
+                    with open(part_path, "ab" if offset else "wb") as file:
+                        for block in response.iter_content(DOWNLOAD_BLOCK_SIZE):
+                            file.write(block)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt >= DOWNLOAD_RETRIES:
+                    raise
+                print(f"Download of {url} interrupted ({e}), resuming...")
+                time.sleep(2 ** attempt)
+
+    os.replace(part_path, path)
+    content_hash = file_sha256(path)
+    _write_json(meta_path, {"url": url, **meta["partial"], "sha256": content_hash})
+    return path, content_hash
+
+
+def _parse_pages(path: str, start: int, stop: int, chunk_size: int, chunk_overlap: int) -> list:
+    """Extract and split pages [start, stop) of a PDF. Runs in a parser process."""
+    reader = PdfReader(path)
+    text_splitter = CharacterTextSplitter(separator="\n", chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return [(page, text_splitter.split_text(reader.pages[page].extract_text()))
+            for page in range(start, stop)]
+
+
+def parser_workers() -> int:
+    """Number of parser processes, overridable with the INGEST_WORKERS env var."""
+    return int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+
+
+def iter_pdf_chunks(path: str, url: str, chunk_size: int = 768, chunk_overlap: int = 0, workers: int = None):
+    """
+    Parse and split a PDF across a process pool, yielding chunks in page order.
+
+    Pages are split independently, exactly like splitting the per-page documents
+    PyPDFLoader returns, and every chunk is tagged with manifest metadata.
+    """
+    workers = workers or parser_workers()
+    page_count = len(PdfReader(path).pages)
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count))
+              for start in range(0, page_count, PAGES_PER_TASK)]
+
+    if workers <= 1 or len(ranges) <= 1:
+        parsed = (_parse_pages(path, start, stop, chunk_size, chunk_overlap) for start, stop in ranges)
+        yield from _to_documents(parsed, path, url)
+        return
+
+    # Spawn rather than fork: the Streamlit process already holds torch threads.
+    workers = min(workers, len(ranges))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        yield from _to_documents(_bounded_map(pool, ranges, path, chunk_size, chunk_overlap, 2 * workers), path, url)
+
+
+def _bounded_map(pool, ranges: list, path: str, chunk_size: int, chunk_overlap: int, window: int):
+    """Yield parsed page ranges in order, keeping at most window ranges in flight."""
+    pending = deque()
+    for start, stop in ranges:
+        pending.append(pool.submit(_parse_pages, path, start, stop, chunk_size, chunk_overlap))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _to_documents(parsed_ranges, path: str, url: str):
+    """Turn parsed (page, chunks) ranges into Documents with manifest metadata."""
+    for parsed in parsed_ranges:
+        for page, texts in parsed:
+            for text in texts:
+                yield Document(page_content=text, metadata={
+                    "source": path,
+                    "page": page,
+                    "doc_url": url,
+                    "chunk_hash": chunk_hash(url, page, text),
+                })
+
+
+def _quote(value: str) -> str:
+    """Quote a string literal for a Milvus boolean expression."""
+    return json.dumps(value)
+
+
+class IngestManifest:
+    """
+    Record of which document versions are already present in the vector store.
+
+    The manifest lives in Milvus next to the chunks rather than on local disk,
+    because the pod's /tmp is an in-memory emptyDir that does not survive a restart.
+    Milvus requires every collection to have a vector field, so the manifest
+    carries a two-dimensional placeholder vector that is never searched.
+    Replicas starting together may all try to create it; the first one wins
+    and the others open it.
+    """
+
+    def __init__(self, collection_name: str = MANIFEST_COLLECTION):
+        self.collection_name = collection_name
+        if not utility.has_collection(collection_name):
+            schema = CollectionSchema([
+                FieldSchema("doc_url", DataType.VARCHAR, is_primary=True, max_length=2048),
+                FieldSchema("doc_version", DataType.VARCHAR, max_length=64),
+                FieldSchema("collection_name", DataType.VARCHAR, max_length=255),
+                FieldSchema("chunk_count", DataType.INT64),
+                FieldSchema("placeholder", DataType.FLOAT_VECTOR, dim=2),
+            ], description="Ingested document versions")
+            try:
+                collection = Collection(collection_name, schema)
+                collection.create_index("placeholder", {"index_type": "FLAT", "metric_type": "L2", "params": {}})
+            except MilvusException:
+                pass  # Another replica created it first.
+        self.collection = Collection(collection_name)
+        self.collection.load()
+
+    def get(self, url: str) -> dict:
+        """Return the manifest entry for a document URL, or None."""
+        rows = self.collection.query(
+            expr=f"doc_url == {_quote(url)}",
+            output_fields=["doc_version", "collection_name", "chunk_count"]
+        )
+        return rows[0] if rows else None
+
+    def put(self, url: str, version: str, collection_name: str, chunk_count: int):
+        """Record that a document version is fully ingested."""
+        self.collection.delete(f"doc_url in [{_quote(url)}]")
+        self.collection.insert([[url], [version], [collection_name], [chunk_count], [[0.0, 0.0]]])
+        self.collection.flush()
+
+    def urls(self) -> list:
+        """Return the URL of every document in the manifest."""
+        rows = self.collection.query(expr='doc_url != ""', output_fields=["doc_url"])
+        return [row["doc_url"] for row in rows]
+
+    def remove(self, url: str):
+        """Forget a document that is no longer ingested."""
+        self.collection.delete(f"doc_url in [{_quote(url)}]")
+        self.collection.flush()
+
+
+def _has_chunk_fields(collection_name: str) -> bool:
+    """Whether a collection's chunks carry the manifest metadata."""
+    field_names = {field.name for field in Collection(collection_name).schema.fields}
+    return set(CHUNK_METADATA_FIELDS) <= field_names
+
+
+def _drop_incompatible_collection(collection_name: str, report=print):
+    """Drop a collection created before chunks carried manifest metadata."""
+    if not utility.has_collection(collection_name):
+        return
+    if not _has_chunk_fields(collection_name):
+        report(f"Collection {collection_name} predates the ingestion manifest, rebuilding it...")
+        utility.drop_collection(collection_name)
+
+
+# Build and search parameters used when MILVUS_INDEX_PARAMS / MILVUS_SEARCH_PARAMS
+# leave them out.
+INDEX_DEFAULTS = {
+    "FLAT": ({}, {}),
+    "IVF_FLAT": ({"nlist": 128}, {"nprobe": 16}),
+    "IVF_SQ8": ({"nlist": 128}, {"nprobe": 16}),
+    "HNSW": ({"M": 16, "efConstruction": 200}, {"ef": 64}),
+}
+
+
+def milvus_index_config(index_type: str = "HNSW", build_params: dict = None, search_params: dict = None,
+                        metric_type: str = "L2"):
+    """Return (index_params, search_params) in the form Milvus and langchain expect."""
+    index_type = index_type.upper()
+    if index_type not in INDEX_DEFAULTS:
+        raise ValueError(f"Unsupported Milvus index type {index_type}, expected one of {', '.join(INDEX_DEFAULTS)}")
+    default_build, default_search = INDEX_DEFAULTS[index_type]
+    return (
+        {"index_type": index_type, "metric_type": metric_type, "params": {**default_build, **(build_params or {})}},
+        {"metric_type": metric_type, "params": {**default_search, **(search_params or {})}},
+    )
+
+
+def _index_matches(collection: Collection, field_name: str, index_params: dict) -> bool:
+    existing = [index.params for index in collection.indexes if index.field_name == field_name]
+    return bool(existing) and existing[0].get("index_type") == index_params["index_type"] \
+        and {k: str(v) for k, v in existing[0].get("params", {}).items()} == \
+        {k: str(v) for k, v in index_params["params"].items()}
+
+
+def _ensure_index(collection: Collection, field_name: str, index_params: dict, report=print):
+    """Rebuild the vector index when the configured index differs from the existing one."""
+    if _index_matches(collection, field_name, index_params):
+        return
+    existing = [index for index in collection.indexes if index.field_name == field_name]
+    report(f"Building {index_params['index_type']} index on {collection.name}...")
+    collection.release()
+    if existing:
+        collection.drop_index()
+    collection.create_index(field_name, index_params)
+    collection.load()
+
+
+def source_partition(url: str) -> str:
+    """Milvus partition holding the chunks of one source document."""
+    return "doc_" + hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+
+
+class ChunkMilvus(Milvus):
+    """
+    Milvus vector store with the chunk bookkeeping sync_documents needs.
+
+    Chunks of each source document go to their own partition, so a search
+    scoped to some documents only scans their partitions. Chunks ingested
+    before partitioning live in the default partition and are still found
+    through the doc_url filter.
+    """
+
+    def has_data(self) -> bool:
+        return self.col is not None
+
+    def _ensure_partition(self, url: str, embedding: list, metadata: dict) -> str:
+        """Create the collection and the partition of a source document if needed."""
+        partition = source_partition(url)
+        if self.col is None:
+            # The collection is created from the first insert; a partition needs it to exist first.
+            self._init([embedding], [metadata])
+        if not self.col.has_partition(partition):
+            self.col.create_partition(partition)
+            self.col.load()
+        return partition
+
+    def add_documents(self, documents: list, **kwargs) -> list:
+        """Insert chunks into the partition of their source document."""
+        ids = []
+        for url, group in itertools.groupby(documents, key=lambda doc: doc.metadata["doc_url"]):
+            group = list(group)
+            embedding = None if self.col is not None else self.embedding_func.embed_documents([group[0].page_content])[0]
+            partition = self._ensure_partition(url, embedding, group[0].metadata)
+            ids.extend(super().add_documents(group, partition_name=partition, **kwargs))
+        return ids
+
+    def copy_chunks(self, source_name: str, urls: list, report=print, batch_size: int = 1000) -> int:
+        """Copy the stored chunks of some documents, vectors included, from another collection."""
+        source = Collection(source_name)
+        fields = [field.name for field in source.schema.fields if not field.auto_id]
+        iterator = source.query_iterator(batch_size=batch_size, expr=f"doc_url in {json.dumps(urls)}",
+                                         output_fields=fields)
+        copied = 0
+        while rows := iterator.next():
+            for url, group in itertools.groupby(sorted(rows, key=lambda row: row["doc_url"]),
+                                                key=lambda row: row["doc_url"]):
+                group = list(group)
+                partition = self._ensure_partition(url, group[0][self._vector_field],
+                                                   {field: group[0][field] for field in CHUNK_METADATA_FIELDS})
+                target_fields = [field.name for field in self.col.schema.fields if not field.auto_id]
+                self.col.insert([[row[field] for row in group] for field in target_fields], partition_name=partition)
+            copied += len(rows)
+            report(f"Copied {copied} stored chunks from {source_name}...")
+        iterator.close()
+        return copied
+
+    def similarity_search_with_score_by_vector(self, embedding: list, k: int = 4, sources: list = None,
+                                                **kwargs) -> list:
+        """Search all chunks, or only the chunks of the source document URLs in sources."""
+        if sources:
+            partitions = [partition.name for partition in self.col.partitions
+                          if partition.name in {source_partition(url) for url in sources} | {"_default"}]
+            kwargs.update(partition_names=partitions, expr=f"doc_url in {json.dumps(list(sources))}")
+        return super().similarity_search_with_score_by_vector(embedding, k=k, **kwargs)
+
+    def stored_chunks(self, url: str) -> dict:
+        """Map chunk hash to primary key for every stored chunk of a document."""
+        if self.col is None:
+            return {}
+        rows = self.col.query(expr=f"doc_url == {_quote(url)}", output_fields=[self._primary_field, "chunk_hash"])
+        return {row["chunk_hash"]: row[self._primary_field] for row in rows}
+
+    def delete_chunks(self, ids: list):
+        self.col.delete(f"{self._primary_field} in {json.dumps(ids)}")
+
+    def chunk_vectors(self, hashes: list) -> dict:
+        """Map chunk hash to stored embedding for the given chunks."""
+        if self.col is None or not hashes:
+            return {}
+        rows = self.col.query(expr=f"chunk_hash in {json.dumps(hashes)}", output_fields=["chunk_hash", self._vector_field])
+        return {row["chunk_hash"]: row[self._vector_field] for row in rows}
+
+    def iter_chunks(self, url: str):
+        """Yield every stored chunk of a document without its vector."""
+        if self.col is None:
+            return
+        rows = self.col.query(expr=f"doc_url == {_quote(url)}", output_fields=[self._text_field, *CHUNK_METADATA_FIELDS])
+        for row in rows:
+            yield Document(page_content=row[self._text_field],
+                           metadata={field: row[field] for field in CHUNK_METADATA_FIELDS})
+
+
+def open_milvus_store(embeddings, collection_name: str, connection_args: dict, index_config: tuple = None,
+                      report=print):
+    """
+    Open the Milvus chunk collection and its manifest for sync_documents.
+
+    index_config is an (index_params, search_params) pair from milvus_index_config.
+    An existing collection is re-indexed if its index does not match.
+    """
+    index_params, search_params = index_config or milvus_index_config()
+    _drop_incompatible_collection(collection_name, report)
+    vector_store = ChunkMilvus(
+        embedding_function=embeddings,
+        collection_name=collection_name,
+        connection_args=connection_args,
+        index_params=index_params,
+        search_params=search_params
+    )
+    if vector_store.col is not None:
+        _ensure_index(vector_store.col, vector_store._vector_field, index_params, report)
+    return vector_store, IngestManifest()
+
+
+class VersionedMilvus:
+    """
+    Blue/green versions of the chunk collection behind a Milvus alias.
+
+    Queries always go to the alias. A re-ingest builds a new {alias}_v<timestamp>
+    collection next to the live one, switches the alias over in one call once
+    it is complete, and only then drops the older versions, so no reader ever
+    sees an empty or half-built index.
+    """
+
+    def __init__(self, embeddings, alias: str, connection_args: dict, index_config: tuple = None):
+        self.embeddings = embeddings
+        self.alias = alias
+        self.connection_args = connection_args
+        self.index_params, self.search_params = index_config or milvus_index_config()
+
+    def open(self, collection_name: str) -> ChunkMilvus:
+        """Open a version, or the alias, as a vector store."""
+        return ChunkMilvus(
+            embedding_function=self.embeddings,
+            collection_name=collection_name,
+            connection_args=self.connection_args,
+            index_params=self.index_params,
+            search_params=self.search_params
+        )
+
+    def versions(self) -> list:
+        pattern = re.compile(rf"{re.escape(self.alias)}_v\d+")
+        return sorted(name for name in utility.list_collections() if pattern.fullmatch(name))
+
+    def current(self) -> str:
+        """The collection the alias points to, the alias itself for a pre-alias collection, or None."""
+        for name in self.versions():
+            if self.alias in utility.list_aliases(name):
+                return name
+        return self.alias if utility.has_collection(self.alias) else None
+
+    def new_version(self) -> str:
+        return f"{self.alias}_v{time.strftime('%Y%m%d%H%M%S')}"
+
+    def is_reusable(self, name: str) -> bool:
+        """Whether a version can be served as is with the configured index."""
+        return name != self.alias and _has_chunk_fields(name) and \
+            _index_matches(Collection(name), self.open(name)._vector_field, self.index_params)
+
+    def switch(self, name: str, report=print):
+        """Point the alias at a complete version and drop the others."""
+        current = self.current()
+        if current == self.alias:
+            # An alias cannot share its name with a collection.
+            report(f"Replacing collection {self.alias} with an alias...")
+            utility.drop_collection(self.alias)
+            current = None
+        if current is None:
+            utility.create_alias(name, self.alias)
+        else:
+            utility.alter_alias(name, self.alias)
+        report(f"{self.alias} now serves {name}.")
+        for old in self.versions():
+            if old != name:
+                report(f"Dropping old version {old}...")
+                utility.drop_collection(old)
+
+
+def open_versioned_milvus(embeddings, alias: str, connection_args: dict, index_config: tuple = None):
+    """Open the versioned chunk collections and the manifest for sync_blue_green."""
+    return VersionedMilvus(embeddings, alias, connection_args, index_config), IngestManifest()
+
+
+def sync_blue_green(pdf_urls: list, versions: VersionedMilvus, manifest, config: dict, store_name: str,
+                    report=print, on_ready=None, sparse_index=None, lock=None, reopen=None):
+    """
+    Bring the alias up to date with the given documents without disturbing readers.
+
+    If every document is unchanged in the live version, nothing is rebuilt.
+    Otherwise a new version is built: the stored chunks of every document
+    still configured are copied over with their vectors, changed documents go
+    through sync_documents, which only embeds their new chunks, and the alias
+    is switched once everything is in. Until then queries keep being served
+    from the previous version. Documents fetched for the up-to-date check are
+    not fetched again for the build. Returns the vector store on the alias.
+    store_name is unused, the alias names the store.
+
+    sparse_index, a BM25Index, is kept as one file per version next to its
+    path (see BM25Index.version_path): it is switched to the live version's
+    file first, and a new version's index is built alongside the new
+    collection and served from the alias switch on.
+
+    With a lock (see ingest_lock), only one replica checks and builds at a
+    time; the others serve the alias meanwhile and then find it up to date.
+    reopen, if given, returns a fresh (versions, manifest) pair once the lock
+    is held. The alias is only switched while the lock is still held.
+    """
+    config_hash = config_fingerprint(config)
+    current = versions.current()
+    if sparse_index is not None and current is not None:
+        sparse_index.open(sparse_index.version_path(current))
+    if on_ready and current is not None:
+        serving = versions.open(versions.alias)
+        if serving.has_data():
+            on_ready(serving)
+            on_ready = None
+
+    if lock is None:
+        return _build_blue_green(pdf_urls, versions, manifest, config, config_hash, report, on_ready, sparse_index)
+    lock.acquire(report)
+    try:
+        if reopen is not None:
+            versions, manifest = reopen()
+        return _build_blue_green(pdf_urls, versions, manifest, config, config_hash, report, on_ready, sparse_index,
+                                 lock)
+    finally:
+        lock.release()
+
+
+def _build_blue_green(pdf_urls: list, versions: VersionedMilvus, manifest, config: dict, config_hash: str,
+                      report, on_ready, sparse_index, lock=None):
+    current = versions.current()
+    if sparse_index is not None and current is not None:
+        sparse_index.open(sparse_index.version_path(current))
+
+    fetched = {}
+    stored = []  # Documents whose chunks the live version holds
+    unchanged = {}
+    if current is not None and _has_chunk_fields(current):
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as downloads:
+            fetched = dict(zip(pdf_urls, downloads.map(fetch_document, pdf_urls)))
+        for url in pdf_urls:
+            entry = manifest.get(url)
+            if not entry or entry["collection_name"] != current:
+                continue
+            stored.append(url)
+            if entry["doc_version"] == document_version(url, fetched[url][1], config_hash):
+                unchanged[url] = entry
+        # Documents dropped from pdf_urls also need a new version without their chunks.
+        if len(unchanged) == len(pdf_urls) and set(manifest.urls()) == set(pdf_urls) \
+                and versions.is_reusable(current):
+            report(f"{versions.alias} is up to date.")
+            # Nothing is re-embedded; this only brings the keyword index up to date.
+            return sync_documents(pdf_urls, versions.open(versions.alias), manifest, config, current,
+                                  report, on_ready, sparse_index, fetched=fetched)
+
+    name = versions.new_version()
+    report(f"Building {name}...")
+    target = versions.open(name)
+    if sparse_index is None:
+        target_index = None
+    elif current is None:
+        # Nothing is served yet, so the new version's keyword index serves as it fills.
+        sparse_index.open(sparse_index.version_path(name))
+        target_index = sparse_index
+    else:
+        target_index = sparse_index.for_version(name)
+    if stored:
+        # Changed documents are copied too, so only their new chunks are embedded.
+        target.copy_chunks(current, stored, report)
+        for url, entry in unchanged.items():
+            manifest.put(url, entry["doc_version"], name, entry["chunk_count"])
+            if target_index is not None and sparse_index.doc_versions.get(url) == entry["doc_version"]:
+                target_index.copy_document(sparse_index, url)
+    sync_documents(pdf_urls, target, manifest, config, name, report, on_ready, target_index, fetched=fetched)
+    if lock is not None:
+        # Switching drops the other versions, which may belong to a replica that took over.
+        lock.check()
+    old_versions = [version for version in versions.versions() + [versions.alias] if version != name]
+    versions.switch(name, report)
+    if sparse_index is not None:
+        sparse_index.adopt(target_index)
+        for version in old_versions:
+            if os.path.exists(sparse_index.version_path(version)):
+                os.remove(sparse_index.version_path(version))
+    return versions.open(versions.alias)
+
+
+def batched(iterable, size: int):
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def prefetch(iterable, depth: int):
+    """
+    Consume iterable in a background thread, at most depth items ahead of the caller.
+
+    The bounded queue is the backpressure between pipeline stages: the producer
+    blocks once the consumer falls depth items behind.
+    """
+    items = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while (item := items.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Lets the producer exit if the consumer stops early or fails.
+        stopped.set()
+
+
+def sync_documents(pdf_urls: list, vector_store, manifest, config: dict, store_name: str,
+                   report=print, on_ready=None, sparse_index=None, lock=None, reopen=None, fetched=None):
+    """
+    Bring the vector store up to date with the given documents.
+
+    Documents whose URL, content hash and pipeline config match the manifest are
+    skipped without being parsed or embedded. For changed documents only the
+    chunks that are not already stored are embedded and inserted, and chunks
+    that disappeared from the new revision are deleted. Documents in the
+    manifest or keyword index that are no longer in pdf_urls are removed.
+
+    Chunks stream from the parser to the store in batches of INSERT_BATCH_SIZE,
+    so memory stays flat regardless of document size. on_ready is called with
+    the vector store as soon as it holds searchable data.
+
+    vector_store is a ChunkMilvus or any store with the same add_documents,
+    has_data, stored_chunks, delete_chunks and iter_chunks methods; manifest has
+    get, put, urls and remove. sparse_index, a BM25Index, is kept in step with the same chunks.
+    lock (see ingest_lock) is held while the store is written, so replicas
+    sharing the store take turns and only the first one does the work.
+    reopen, if given, returns a fresh (vector_store, manifest) pair once the
+    lock is held, so a store another replica wrote to while this one waited
+    is not synced from stale contents. fetched maps URLs already fetched by
+    the caller to their (local path, content hash), so they are not fetched
+    again.
+    """
+    config_hash = config_fingerprint(config)
+    fetched = fetched or {}
+    ready = False
+    if vector_store.has_data() and on_ready:
+        on_ready(vector_store)
+        ready = True
+
+    if lock is not None:
+        lock.acquire(report)
+    # Later documents download while earlier ones are parsed and embedded.
+    downloads = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+    pending = {url: downloads.submit(fetch_document, url) for url in dict.fromkeys(pdf_urls) if url not in fetched}
+    try:
+        if lock is not None and reopen is not None:
+            vector_store, manifest = reopen()
+            if vector_store.has_data() and on_ready:
+                on_ready(vector_store)
+                ready = True
+
+        for url in manifest.urls():
+            if url not in pdf_urls:
+                report(f"Removing {pdf_name_from_url(url)}, which is no longer configured...")
+                stored = vector_store.stored_chunks(url)
+                if stored:
+                    vector_store.delete_chunks(list(stored.values()))
+                manifest.remove(url)
+        if sparse_index is not None:
+            for url in sparse_index.document_urls() - set(pdf_urls):
+                sparse_index.remove_document(url)
+
+        for url in pdf_urls:
+            name = pdf_name_from_url(url)
+            if url in fetched:
+                path, content_hash = fetched[url]
+            else:
+                report(f"Downloading {name}...")
+                path, content_hash = pending[url].result()
+            version = document_version(url, content_hash, config_hash)
+
+            entry = manifest.get(url)
+            if entry and entry["doc_version"] == version and entry["collection_name"] == store_name:
+                report(f"{name} is unchanged, skipping.")
+                if sparse_index is not None and sparse_index.doc_versions.get(url) != version:
+                    report(f"Building keyword index for {name}...")
+                    sparse_index.replace_document(url, vector_store.iter_chunks(url))
+                    sparse_index.doc_versions[url] = version
+                continue
+
+            report(f"Processing {name}...")
+            stored = vector_store.stored_chunks(url)
+            current = set()
+            inserted = 0
+
+            chunks = iter_pdf_chunks(path, url, config["chunk_size"], config["chunk_overlap"])
+            for batch in prefetch(batched(chunks, INSERT_BATCH_SIZE), PREFETCH_BATCHES):
+                if lock is not None:
+                    lock.check()
+                current.update(doc.metadata["chunk_hash"] for doc in batch)
+                if sparse_index is not None:
+                    sparse_index.add_documents(batch)
+                new_docs = [doc for doc in batch if doc.metadata["chunk_hash"] not in stored]
+                if not new_docs:
+                    continue
+                vector_store.add_documents(new_docs)
+                inserted += len(new_docs)
+                report(f"Embedded {inserted} new chunks of {name}...")
+                if not ready and on_ready:
+                    on_ready(vector_store)
+                    ready = True
+
+            stale = [pk for hash_, pk in stored.items() if hash_ not in current]
+            if stale:
+                report(f"Removing {len(stale)} outdated chunks of {name}...")
+                vector_store.delete_chunks(stale)
+            if sparse_index is not None:
+                # stored is empty when building a new blue/green version, so the
+                # previous revision's chunks are found in the keyword index itself.
+                sparse_index.remove_document(url, keep=current)
+                sparse_index.doc_versions[url] = version
+
+            manifest.put(url, version, store_name, len(current))
+    finally:
+        downloads.shutdown(wait=False, cancel_futures=True)
+        if lock is not None:
+            lock.release()
+
+    if sparse_index is not None:
+        sparse_index.save()
+    return vector_store
+
+
+def corpus_version(manifest, pdf_urls: list) -> str:
+    """Identify the ingested corpus as a whole, from the manifest entry of each document."""
+    versions = [(url, (manifest.get(url) or {}).get("doc_version", "")) for url in sorted(pdf_urls)]
+    return hashlib.sha256(json.dumps(versions).encode("utf-8")).hexdigest()
+
+
+class IngestJob:
+    """
+    Run sync_documents in a background thread so the app can answer questions
+    from the chunks indexed so far instead of waiting for the whole corpus.
+
+    open_store is called on the background thread and returns the
+    (vector_store, manifest) pair to sync into, e.g. open_milvus_store. sync is
+    sync_documents, or sync_blue_green with open_versioned_milvus. lock, from
+    ingest_lock, keeps replicas from ingesting at the same time; open_store is
+    called again once it is held, to see what another replica wrote meanwhile.
+    """
+
+    def __init__(self, pdf_urls: list, open_store, config: dict, store_name: str, sparse_index=None,
+                 sync=sync_documents, lock=None):
+        self.pdf_urls = pdf_urls
+        self.sparse_index = sparse_index
+        self.sync = sync
+        self.lock = lock
+        self.messages = []
+        self.vector_store = None
+        self.manifest = None
+        self.corpus_version = None
+        self.error = None
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(open_store, config, store_name), daemon=True)
+        self.thread.start()
+
+    def _set_ready(self, vector_store):
+        self.vector_store = vector_store
+        self.ready.set()
+
+    def _run(self, open_store, config: dict, store_name: str):
+        def reopen():
+            store, self.manifest = open_store()
+            return store, self.manifest
+
+        try:
+            store, manifest = reopen()
+            vector_store = self.sync(self.pdf_urls, store, manifest, config, store_name,
+                                     report=self.messages.append, on_ready=self._set_ready,
+                                     sparse_index=self.sparse_index, lock=self.lock, reopen=reopen)
+            if vector_store.has_data():
+                self._set_ready(vector_store)
+            self.corpus_version = corpus_version(self.manifest, self.pdf_urls)
+            self.messages.append("Processing complete!")
+        except Exception as e:
+            self.error = e
+            self.messages.append(f"Ingestion failed: {e}")
+        finally:
+            self.ready.set()
+            self.done.set()
+
+    @property
+    def status(self) -> str:
+        """Latest progress message."""
+        return self.messages[-1] if self.messages else "Starting..."
@@ -0,0 +1,368 @@
+import asyncio
+import codecs
+import concurrent.futures
+import contextlib
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+
+# Connection pool shared by every request to one llama.cpp server.
+MAX_CONNECTIONS = int(os.getenv("LLAMA_MAX_CONNECTIONS", "16"))
+KEEPALIVE_EXPIRY = 60.0
+
+# Seconds between two reads of a response before it is given up. Bounds the
+# gap between tokens, not the length of the whole generation.
+READ_TIMEOUT = 120.0
+
+# Retry and circuit breaker settings.
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Seconds before asking the server for its slot count again after a failed
+# attempt; requests that wait for a slot run one at a time meanwhile.
+SLOTS_RETRY = 30.0
+
+
+class LlamaClientError(Exception):
+    """The llama.cpp server could not produce a completion."""
+
+
+class CircuitOpenError(LlamaClientError):
+    """Requests are being rejected because the server kept failing."""
+
+
+class SSEDecoder:
+    """
+    Incremental decoder for a text/event-stream body.
+
+    Network chunks do not line up with events: one chunk can hold several
+    events or end in the middle of one (or of a multi-byte character), so bytes
+    are buffered until a blank line completes an event.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._data = []
+
+    def feed(self, chunk: bytes) -> list:
+        """Add bytes from the stream and return the data of every completed event."""
+        self._buffer += self._decoder.decode(chunk)
+        events = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            event = self._line(line.rstrip("\r"))
+            if event is not None:
+                events.append(event)
+        return events
+
+    def flush(self) -> list:
+        """Return the last event if the stream ended without a trailing blank line."""
+        self._buffer += self._decoder.decode(b"", final=True)
+        events = []
+        if self._buffer:
+            event = self._line(self._buffer.rstrip("\r"))
+            self._buffer = ""
+            if event is not None:
+                events.append(event)
+        event = self._line("")
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _line(self, line: str):
+        if not line:
+            if not self._data:
+                return None
+            data, self._data = "\n".join(self._data), []
+            return data
+        if line.startswith(":"):
+            return None
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self._data.append(value)
+        elif field == "error":
+            # llama.cpp reports failures mid-stream on an "error:" line.
+            raise LlamaClientError(f"llama.cpp error: {value}")
+        return None
+
+
+class CircuitBreaker:
+    """Fail fast after repeated failures, then let one request probe the server."""
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError("llama.cpp server is unavailable, not sending request")
+            # Half-open: let this request through and re-open straight away if it fails.
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop that owns every pooled connection.
+
+    Streamlit runs each request under a fresh asyncio.run() loop, and httpx
+    connections cannot outlive the loop that opened them, so requests are run
+    on one long-lived loop and their results are handed back to the caller.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llama-client", daemon=True).start()
+        return _loop
+
+
+class LlamaClient:
+    """Client for the llama.cpp /completion endpoint with a persistent connection pool."""
+
+    def __init__(self, host: str, port: str, max_connections: int = MAX_CONNECTIONS):
+        self.base_url = f"http://{host}:{port}"
+        self.max_connections = max_connections
+        self.breaker = CircuitBreaker()
+        self.slot_limit = None  # Requests run at once by wait_for_slot; None reads the server's slot count
+        self._http = None
+        self._slots_lock = None
+        self._slots_failed_at = None
+        self._slot_free = None
+        self._active = 0
+
+    def _client(self) -> httpx.AsyncClient:
+        # Only called on the background loop.
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections,
+                                    keepalive_expiry=KEEPALIVE_EXPIRY),
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=5),
+            )
+        return self._http
+
+    async def _slot_limit(self) -> int:
+        # Only called on the background loop.
+        if self._slots_lock is None:
+            self._slots_lock = asyncio.Lock()
+        async with self._slots_lock:
+            if self.slot_limit is None and (self._slots_failed_at is None
+                                            or time.monotonic() - self._slots_failed_at >= SLOTS_RETRY):
+                try:
+                    response = await self._client().get("/props", timeout=5)
+                    response.raise_for_status()
+                    self.slot_limit = max(1, int(response.json().get("total_slots", 1)))
+                except (httpx.HTTPError, ValueError, TypeError) as e:
+                    print(f"Could not read llama.cpp slot count, running one request at a time: {e}")
+                    self._slots_failed_at = time.monotonic()
+        return self.slot_limit or 1
+
+    @contextlib.asynccontextmanager
+    async def _slot(self):
+        """
+        Hold one of the server's parallel slots (its -np setting).
+
+        Shared by every request of the process that waits for a slot, so
+        sessions together never send more requests than the server decodes
+        at once; the rest would only queue there while their deadlines run.
+        """
+        if self._slot_free is None:
+            self._slot_free = asyncio.Condition()
+        limit = await self._slot_limit()
+        async with self._slot_free:
+            while self._active >= limit:
+                await self._slot_free.wait()
+                limit = self.slot_limit or 1
+            self._active += 1
+        try:
+            yield
+        finally:
+            async with self._slot_free:
+                self._active -= 1
+                self._slot_free.notify_all()
+
+    async def stream(self, prompt: str, deadline: float = 120, wait_for_slot: bool = False, **params):
+        """
+        Yield completion tokens as the server generates them.
+
+        deadline bounds connecting, retries and the wait for the first token,
+        in seconds. Once tokens flow, generation runs until it ends as long as
+        each read arrives within READ_TIMEOUT, so long completions on a slow
+        server are not cut off. With wait_for_slot, the request first waits
+        for a free server slot, which does not count against the deadline.
+        Extra keyword arguments are passed to llama.cpp (temperature,
+        n_predict, ...).
+        """
+        caller_loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+        done = object()
+
+        def emit(item):
+            try:
+                caller_loop.call_soon_threadsafe(tokens.put_nowait, item)
+            except RuntimeError:
+                pass  # The caller stopped reading and its loop is closed.
+
+        async def produce():
+            first_token = asyncio.Event()
+
+            def emit_token(token):
+                first_token.set()
+                emit(token)
+
+            try:
+                async with self._slot() if wait_for_slot else contextlib.nullcontext():
+                    request = asyncio.ensure_future(self._produce(prompt, params, deadline, emit_token))
+                    waiter = asyncio.ensure_future(first_token.wait())
+                    try:
+                        await asyncio.wait({request, waiter}, timeout=deadline,
+                                           return_when=asyncio.FIRST_COMPLETED)
+                        if not first_token.is_set() and not request.done():
+                            emit(LlamaClientError(f"No response from llama.cpp within {deadline}s"))
+                            return
+                        await request
+                    finally:
+                        request.cancel()
+                        waiter.cancel()
+            except Exception as e:
+                emit(e)
+            finally:
+                emit(done)
+
+        future = asyncio.run_coroutine_threadsafe(produce(), _background_loop())
+        try:
+            while (item := await tokens.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    async def complete(self, prompt: str, deadline: float = 120, wait_for_slot: bool = False, **params) -> str:
+        """Return the whole completion as one string."""
+        full_response = ""
+        async for token in self.stream(prompt, deadline, wait_for_slot, **params):
+            full_response += token
+        return full_response
+
+    async def _produce(self, prompt: str, params: dict, deadline: float, emit):
+        """Run the request on the background loop, retrying until tokens start to flow."""
+        json_data = {"prompt": prompt, **params, "stream": True}
+        expires = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            self.breaker.before_request()
+            started = False
+            try:
+                async with self._client().stream("POST", "/completion", json=json_data) as response:
+                    if response.status_code >= 400:
+                        body = (await response.aread()).decode("utf-8", "replace")[:200]
+                        raise httpx.HTTPStatusError(f"llama.cpp returned {response.status_code}: {body}",
+                                                    request=response.request, response=response)
+                    decoder = SSEDecoder()
+                    async for chunk in response.aiter_bytes():
+                        for event in decoder.feed(chunk):
+                            started |= self._emit_event(event, emit)
+                    for event in decoder.flush():
+                        started |= self._emit_event(event, emit)
+                self.breaker.record_success()
+                return
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                retryable = (not isinstance(e, httpx.HTTPStatusError)
+                             or e.response.status_code in RETRYABLE_STATUS)
+                # A rejected request (e.g. 400 for an oversized prompt) says nothing about server health.
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                # Tokens already shown cannot be taken back, so only retry before the first one.
+                if started or not retryable or attempt >= MAX_RETRIES:
+                    raise LlamaClientError(str(e)) from e
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if time.monotonic() + delay >= expires:
+                    raise LlamaClientError(f"{e} (no time left to retry)") from e
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def count_tokens(self, texts: list, timeout: float = 10) -> list:
+        """
+        Count the tokens of each text with the served model's tokenizer.
+
+        Blocking; the /tokenize requests run concurrently on the shared pool.
+        Special tokens such as BOS are not included.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._tokenize(texts), _background_loop())
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError as e:
+            future.cancel()
+            raise LlamaClientError(f"No tokenizer response from llama.cpp within {timeout}s") from e
+        except httpx.HTTPError as e:
+            raise LlamaClientError(str(e)) from e
+
+    async def _tokenize(self, texts: list) -> list:
+        async def count(text):
+            response = await self._client().post("/tokenize", json={"content": text})
+            response.raise_for_status()
+            return len(response.json()["tokens"])
+        return list(await asyncio.gather(*(count(text) for text in texts)))
+
+    @staticmethod
+    def _emit_event(event: str, emit) -> bool:
+        """Send the token carried by one SSE event to the caller."""
+        try:
+            data = json.loads(event)
+        except ValueError:
+            return False
+        if data.get("stop") is False and data.get("content"):
+            emit(data["content"])
+            return True
+        return False
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_llama_client(host: str, port: str) -> LlamaClient:
+    """Return the process-wide client for a llama.cpp server, creating it on first use."""
+    key = (host, str(port))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = LlamaClient(host, port)
+        return _clients[key]
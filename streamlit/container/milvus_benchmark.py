@@ -0,0 +1,127 @@
+"""
+Compare Milvus index settings on the ingested corpus.
+
+Copies the vectors of an existing collection into a scratch collection per
+index configuration, then reports recall@k against exact (brute force) search
+together with p50/p99 single-query latency:
+
+    python milvus_benchmark.py --collection lighthouse --k 3 \
+        FLAT IVF_FLAT:nlist=128:nprobe=16 IVF_SQ8:nlist=128:nprobe=8 HNSW:M=16:efConstruction=200:ef=64
+
+Each configuration is INDEX_TYPE followed by :key=value parameters. nprobe and
+ef are search parameters, everything else is a build parameter.
+"""
+import argparse
+import time
+
+import numpy as np
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+
+from ingest import milvus_index_config
+
+SEARCH_KEYS = {"nprobe", "ef"}
+
+
+def parse_config(spec: str):
+    """Parse INDEX_TYPE:key=value:... into (index_params, search_params)."""
+    index_type, *pairs = spec.split(":")
+    build, search = {}, {}
+    for pair in pairs:
+        key, value = pair.split("=", 1)
+        (search if key in SEARCH_KEYS else build)[key] = int(value)
+    return milvus_index_config(index_type, build, search)
+
+
+def load_vectors(collection_name: str, vector_field: str = "vector", batch_size: int = 10000) -> np.ndarray:
+    """Read every vector of a collection."""
+    collection = Collection(collection_name)
+    collection.load()
+    pk_field = collection.primary_field.name
+    vectors = []
+    iterator = collection.query_iterator(batch_size=batch_size, expr="", output_fields=[pk_field, vector_field])
+    while batch := iterator.next():
+        vectors.extend(row[vector_field] for row in batch)
+    iterator.close()
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def exact_neighbors(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Ids of the k nearest vectors to each query by squared L2 distance."""
+    distances = (np.einsum("ij,ij->i", vectors, vectors)[None, :] - 2 * queries @ vectors.T)
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(distances, top, axis=1).argsort(axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def run_config(vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, spec: str) -> dict:
+    """Build one index over vectors and measure recall and latency."""
+    index_params, search_params = parse_config(spec)
+    name = f"bench_{index_params['index_type'].lower()}"
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    schema = CollectionSchema([
+        FieldSchema("id", DataType.INT64, is_primary=True),
+        FieldSchema("vector", DataType.FLOAT_VECTOR, dim=vectors.shape[1]),
+    ])
+    collection = Collection(name, schema)
+    try:
+        for start in range(0, len(vectors), 10000):
+            stop = min(start + 10000, len(vectors))
+            collection.insert([list(range(start, stop)), vectors[start:stop].tolist()])
+        collection.flush()
+
+        started = time.perf_counter()
+        collection.create_index("vector", index_params)
+        collection.load()
+        build_seconds = time.perf_counter() - started
+
+        # Warm up before timing
+        collection.search(queries[:1].tolist(), "vector", search_params, limit=k)
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            result = collection.search([query.tolist()], "vector", search_params, limit=k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(set(result[0].ids) & set(expected.tolist()))
+
+        return {
+            "config": spec,
+            "recall": hits / truth.size,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "build_s": build_seconds,
+        }
+    finally:
+        utility.drop_collection(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of Milvus index settings")
+    parser.add_argument("configs", nargs="*", default=["FLAT", "IVF_FLAT", "IVF_SQ8", "HNSW"])
+    parser.add_argument("--host", default="milvus-service")
+    parser.add_argument("--port", default="19530")
+    parser.add_argument("--collection", default="lighthouse")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    connections.connect(host=args.host, port=args.port)
+    vectors = load_vectors(args.collection)
+    rng = np.random.default_rng(args.seed)
+    # Perturbed corpus vectors stand in for questions about the corpus.
+    sample = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = sample + rng.normal(scale=0.05 * sample.std(), size=sample.shape).astype(np.float32)
+    truth = exact_neighbors(vectors, queries, args.k)
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, k={args.k}")
+    print(f"{'config':45} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8}")
+    for spec in args.configs:
+        result = run_config(vectors, queries, truth, args.k, spec)
+        print(f"{result['config']:45} {result['recall']:9.3f} {result['p50_ms']:8.2f} "
+              f"{result['p99_ms']:8.2f} {result['build_s']:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
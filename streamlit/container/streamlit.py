@@ -1,15 +1,22 @@
 import streamlit as st
-import requests
 import os
-from pymilvus import connections, utility
+from pymilvus import connections
 from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import Milvus
-from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import CharacterTextSplitter
-import httpx
-import json
 import asyncio
-import urllib.parse
+import json
+import time
+
+from answer_cache import SemanticAnswerCache
+from bm25 import BM25Index
+from embedding_cache import CachedEmbeddings
+from embedding_client import RemoteEmbeddings
+from ingest_lock import ingest_lock
+from ingest import (IngestJob, document_sources, milvus_index_config, open_versioned_milvus, pdf_name_from_url,
+                    sync_blue_green)
+from llama_client import get_llama_client
+from prompt_builder import build_prompt, compress_context, token_counter
+from quantized_embeddings import load_quantized_embeddings
+from retrieval import adaptive_search
 
 # Streamlit app title
 st.title("Retrieval Augmented Generation based on a given pdf")
@@ -20,112 +27,232 @@ MILVUS_PORT = "19530"
 LLAMA_HOST = "llama-service"
 LLAMA_PORT = "8080"
 
+# Prompt size: the llama-runtime deployments serve a 4096 token context (-c),
+# of which N_PREDICT tokens are reserved for the answer. Retrieved chunks fill
+# the rest, counted with the served model's tokenizer.
+LLAMA_CONTEXT_SIZE = int(os.getenv("LLAMA_CONTEXT_SIZE", "4096"))
+N_PREDICT = int(os.getenv("N_PREDICT", "200"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", str(LLAMA_CONTEXT_SIZE - N_PREDICT)))
+
+# Milvus vector index: FLAT, IVF_FLAT, IVF_SQ8 or HNSW. Build and search
+# parameters are JSON objects merged over the defaults for the index type,
+# e.g. MILVUS_INDEX_PARAMS='{"nlist": 256}' MILVUS_SEARCH_PARAMS='{"nprobe": 32}'.
+# Use milvus_benchmark.py to compare settings on the ingested corpus.
+MILVUS_INDEX = milvus_index_config(
+    os.getenv("MILVUS_INDEX_TYPE", "HNSW"),
+    json.loads(os.getenv("MILVUS_INDEX_PARAMS", "{}")),
+    json.loads(os.getenv("MILVUS_SEARCH_PARAMS", "{}"))
+)
+
+# Ingestion lock shared by the app replicas: "milvus" for a lease record in
+# Milvus, "file:<path>" for a lock file on a shared volume, or "none".
+INGEST_LOCK = os.getenv("INGEST_LOCK", "milvus")
+
+# Chunking and embedding settings. Together with each document's URL and content
+# hash they form the ingestion manifest key, so changing them re-ingests.
+CHUNK_SIZE = 768
+CHUNK_OVERLAP = 0
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Hybrid retrieval: the HYBRID_CANDIDATES best chunks from vector search and
+# from BM25 keyword search are fused by reciprocal rank (RRF_K dampens the
+# weight of the top ranks). The keyword index is kept under BM25_INDEX_DIR,
+# one file per collection version.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", "/.cache/bm25")
+
+# Adaptive retrieval depth, on the cosine similarity of vector search results:
+# RETRIEVAL_K chunks at most when the best one scores at least WEAK_SCORE,
+# RETRIEVAL_MAX_K when it scores lower. Chunks below RELEVANCE_FLOOR are
+# dropped and the list is cut where the score falls by more than SCORE_GAP.
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "6"))
+RELEVANCE_FLOOR = float(os.getenv("RELEVANCE_FLOOR", "0.3"))
+SCORE_GAP = float(os.getenv("SCORE_GAP", "0.1"))
+WEAK_SCORE = float(os.getenv("WEAK_SCORE", "0.5"))
+
+# Maximal marginal relevance re-ranking of the retrieved candidates: 1.0 keeps
+# the relevance order, lower values trade relevance for less duplicated context.
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+
+# Extractive context compression: only the retrieved sentences closest to the
+# question are sent, up to CONTEXT_TOKEN_BUDGET tokens. 0 sends whole chunks.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "512"))
+
+# Embedding backend: "hf" runs the fp32 model, "onnx-int8" or "torch-int8"
+# run an int8 quantized copy on CPU. Check recall and speed on your documents
+# with quantized_embeddings.py first. The backend is part of the embedding
+# cache and ingestion keys, so switching re-embeds.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hf")
+EMBEDDING_BACKEND_KEY = {"embedding_backend": EMBEDDING_BACKEND} if EMBEDDING_BACKEND != "hf" else {}
+
+# Shared embedding service (embedding_server.py). When set, documents and
+# questions are embedded there instead of loading the model in this process.
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "")
+
+# Semantic answer cache settings
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+
+# Function to load the embedding model once per process
+@st.cache_resource
+def load_embeddings():
+    if EMBEDDING_SERVICE_URL:
+        embeddings = RemoteEmbeddings(EMBEDDING_SERVICE_URL)
+    elif EMBEDDING_BACKEND != "hf":
+        embeddings = load_quantized_embeddings(EMBEDDING_BACKEND, "sentence-transformers/" + EMBEDDING_MODEL)
+    else:
+        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    return CachedEmbeddings(
+        embeddings,
+        namespace={"model": EMBEDDING_MODEL, "normalize_embeddings": False, **EMBEDDING_BACKEND_KEY}
+    )
+
+# Function to create the answer cache shared by all sessions
+@st.cache_resource
+def load_answer_cache():
+    return SemanticAnswerCache(
+        load_embeddings(),
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl=ANSWER_CACHE_TTL,
+        max_entries=ANSWER_CACHE_SIZE
+    )
+
 # Function to download and process PDFs
 @st.cache_resource
 def load_and_process_pdfs():
-    pdf_urls = [
-        os.getenv("PDF_URL")
-    ]
-    # Parse the URL
-    url_parts = urllib.parse.urlparse(os.getenv("PDF_URL"))
-    # Get the path
-    path_query = url_parts.path
-    # Split the path into path and filename
-    path_filename = os.path.split(path_query)
-    # Get the filename
-    pdf_names = [os.path.basename(path_filename[1])]
+    # PDF_URLS lists document URLs or paths separated by commas or whitespace
+    # (PDF_URL for a single one); every PDF under PDF_DIR is added as well.
+    pdf_urls = document_sources(os.getenv("PDF_URLS", os.getenv("PDF_URL", "")), os.getenv("PDF_DIR", ""))
 #def load_and_process_pdfs():
 #    pdf_urls = [
         #"https://www.redbooks.ibm.com/redbooks/pdfs/sg248513.pdf",
         #"https://www.redbooks.ibm.com/redbooks/pdfs/sg248512.pdf"
         #"https://github.com/DanielCasali/mma-ai/raw/main/datasource/The_Forgotten_Lighthouse_Book.pdf"
 #    ]
-    #pdf_names = ["The_Forgotten_Lighthouse_Book.pdf"]
-    #pdf_names = ["IBM_Redbook_8513.pdf", "IBM_Redbook_8512.pdf"]
-    
-    all_docs = []
-    
-    for url, name in zip(pdf_urls, pdf_names):
-        if not os.path.exists(name):
-            output_path = os.path.join("/tmp/", name)
-            st.write(f"Downloading {name}...")
-            res = requests.get(url)
-            with open(output_path, 'wb') as file:
-                file.write(res.content)
-        
-        st.write(f"Processing {name}...")
-        loader = PyPDFLoader(output_path)
-        docs = loader.load()
-        text_splitter = CharacterTextSplitter(separator="\n", chunk_size=768, chunk_overlap=0)
-        split_docs = text_splitter.split_documents(docs)
-        all_docs.extend(split_docs)
-    
-    st.write("Embedding documents...")
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+
+    embeddings = load_embeddings()
     
     st.write("Connecting to Milvus...")
     connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
-    colls = utility.list_collections()
-    for coll in colls:
-        utility.drop_collection(coll)
     
-    st.write("Creating vector store...")
-    vector_store = Milvus.from_documents(
-        all_docs,
-        embedding=embeddings,
-        collection_name="lighthouse",
-        connection_args={"host": MILVUS_HOST, "port": MILVUS_PORT}
+    st.write("Synchronizing vector store...")
+    return IngestJob(
+        pdf_urls,
+        # Re-ingestion builds a new collection version behind the "lighthouse" alias
+        lambda: open_versioned_milvus(embeddings, "lighthouse", {"host": MILVUS_HOST, "port": MILVUS_PORT}, MILVUS_INDEX),
+        config={
+            "chunker": "CharacterTextSplitter",
+            "separator": "\n",
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "embedding_model": EMBEDDING_MODEL,
+            **EMBEDDING_BACKEND_KEY,
+        },
+        store_name="lighthouse",
+        sparse_index=BM25Index(os.path.join(BM25_INDEX_DIR, "lighthouse.json")),
+        sync=sync_blue_green,
+        lock=ingest_lock(INGEST_LOCK)
     )
-    
-    st.write("Processing complete!")
-    return vector_store
-
-# Function to build prompt
-def build_prompt(question, topn_chunks: list[str]):
-    prompt = "Instructions: Compose a concise answer to the query using the provided search results, no need to mention you found it in the resuts\n\n"
-    prompt += "Search results:\n"
-    for chunk in topn_chunks:
-        prompt += f"[Document: {chunk[0].metadata.get('source', 'Unknown')}, Page: {chunk[0].metadata.get('page', 'Unknown')}]: " + chunk[0].page_content.replace("\n", " ") + "\n\n"
-    prompt += f"Query: {question}\n\nAnswer: "
-    return prompt
-
-# Asynchronous function to get LLAMA response
-async def get_llama_response(prompt):
-    json_data = {
-        'prompt': prompt,
-        'temperature': 0.1,
-        'n_predict': 200,
-        'stream': True,
-    }
-    async with httpx.AsyncClient(timeout=120) as client:
-        async with client.stream('POST', f'http://{LLAMA_HOST}:{LLAMA_PORT}/completion', json=json_data) as response:
-            full_response = ""
-            async for chunk in response.aiter_bytes():
-                try:
-                    data = json.loads(chunk.decode('utf-8')[6:])
-                    if data['stop'] is False:
-                        full_response += data['content']
-                except:
-                    pass
-    return full_response
-
-# Load and process PDFs
+
+# Asynchronous generator yielding LLAMA response tokens as they are generated
+async def stream_llama_response(prompt):
+    async for token in get_llama_client(LLAMA_HOST, LLAMA_PORT).stream(
+        prompt,
+        temperature=0.1,
+        n_predict=N_PREDICT,
+        cache_prompt=True,
+    ):
+        yield token
+
+# Render LLAMA tokens into a placeholder as they arrive, returning the answer,
+# the time to first token and the total generation time in seconds
+async def render_llama_response(prompt, placeholder):
+    start = time.perf_counter()
+    time_to_first_token = None
+    answer = ""
+    async for token in stream_llama_response(prompt):
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - start
+        answer += token
+        placeholder.markdown(answer + "▌")
+    placeholder.markdown(answer)
+    return answer, time_to_first_token, time.perf_counter() - start
+
+# Load and process PDFs in the background; questions can be asked as soon as
+# the first batch of chunks is searchable.
 with st.spinner("Loading and processing PDFs... This may take a few minutes."):
-    vector_store = load_and_process_pdfs()
+    ingest_job = load_and_process_pdfs()
+    ingest_job.ready.wait()
+
+if ingest_job.error:
+    st.error(f"Error processing PDFs: {ingest_job.error}")
+elif not ingest_job.done.is_set():
+    st.info(f"Still indexing ({ingest_job.status}) Answers use the chunks indexed so far.")
+
+vector_store = ingest_job.vector_store
+if vector_store is None:
+    st.stop()
+
+# Restrict the search to some of the documents
+sources = None
+if len(ingest_job.pdf_urls) > 1:
+    selected = st.multiselect("Search in", ingest_job.pdf_urls, default=ingest_job.pdf_urls,
+                              format_func=pdf_name_from_url)
+    if not selected:
+        st.stop()
+    if len(selected) < len(ingest_job.pdf_urls):
+        sources = selected
 
 # User input
 question = st.text_input("Enter your question about the pdf you picked:")
 
 if question:
-    # Perform similarity search
-    docs = vector_store.similarity_search_with_score(question, k=3)
-    
-    # Build prompt
-    prompt = build_prompt(question, docs)
-    
-    # Get LLAMA response
-    with st.spinner("Generating answer..."):
-        answer = asyncio.run(get_llama_response(prompt))
-    
-    # Display answer
-    st.write("Answer:", answer)
+    answer_cache = load_answer_cache()
+    question_vector = answer_cache.embed(question)
+
+    # Only a fully ingested corpus has a stable version to cache answers against,
+    # and cached answers are for questions over the whole corpus
+    use_answer_cache = ingest_job.corpus_version and sources is None
+    cached = None
+    if use_answer_cache:
+        cached = answer_cache.lookup(question_vector, ingest_job.corpus_version)
+
+    if cached:
+        answer, similarity = cached
+        st.write("Answer:")
+        st.markdown(answer)
+        st.caption(f"Served from the answer cache (similarity {similarity:.2f})")
+    else:
+        # Perform hybrid vector and keyword search, as deep as the scores warrant,
+        # without near-duplicate chunks
+        docs = adaptive_search(vector_store, ingest_job.sparse_index, question, question_vector.tolist(),
+                               base_k=RETRIEVAL_K, max_k=RETRIEVAL_MAX_K, candidates=HYBRID_CANDIDATES,
+                               rrf_k=RRF_K, floor=RELEVANCE_FLOOR, gap=SCORE_GAP, weak=WEAK_SCORE,
+                               mmr_lambda=MMR_LAMBDA, sources=sources)
+        
+        count_tokens = token_counter(get_llama_client(LLAMA_HOST, LLAMA_PORT))
+
+        # Keep only the sentences that answer the question, embedding them
+        # without the chunk embedding cache
+        if CONTEXT_TOKEN_BUDGET:
+            docs = compress_context(question_vector, docs, load_embeddings().embeddings, count_tokens,
+                                    CONTEXT_TOKEN_BUDGET)
+
+        # Build prompt within the model's context window
+        prompt, prompt_tokens = build_prompt(question, docs, count_tokens, PROMPT_TOKEN_BUDGET)
+        
+        # Stream the LLAMA response into the page as it is generated
+        st.write("Answer:")
+        answer_placeholder = st.empty()
+        answer_placeholder.markdown("_Generating answer..._")
+        answer, ttft, total = asyncio.run(render_llama_response(prompt, answer_placeholder))
+        if ttft is None:
+            st.caption(f"Context: {len(docs)} chunks, {prompt_tokens} tokens · No tokens received after {total:.2f}s")
+        else:
+            st.caption(f"Context: {len(docs)} chunks, {prompt_tokens} tokens · Time to first token: {ttft:.2f}s · Total: {total:.2f}s")
+
+        if answer and use_answer_cache:
+            answer_cache.store(question, question_vector, answer, ingest_job.corpus_version)
@@ -0,0 +1,64 @@
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_retrieval(app: str):
+    spec = importlib.util.spec_from_file_location(f"{app}_retrieval", os.path.join(ROOT, app, "container", "retrieval.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Chunk:
+    def __init__(self, text: str):
+        self.page_content = text
+        self.metadata = {"chunk_hash": text}
+
+
+class VectorStore:
+    """Exact search over a few unit vectors, like the stores in ingest.py and numpy_store.py."""
+
+    def __init__(self, vectors: dict):
+        self.vectors = {key: np.asarray(vector, dtype=np.float32) / np.linalg.norm(vector)
+                        for key, vector in vectors.items()}
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, sources: list = None):
+        scored = sorted((float(np.sum((vector - embedding) ** 2)), key) for key, vector in self.vectors.items())
+        return [(Chunk(key), distance) for distance, key in scored[:k]]
+
+    def chunk_vectors(self, hashes: list) -> dict:
+        return {key: self.vectors[key] for key in hashes if key in self.vectors}
+
+
+@pytest.fixture(params=["streamlit", "streamlit-local"])
+def retrieval(request):
+    return load_retrieval(request.param)
+
+
+def search(retrieval, mmr_lambda):
+    # "copy" repeats "intro" almost word for word. "details" is a little less
+    # similar to the question, so it misses the two chunks a strong match
+    # gets, but it says something else.
+    store = VectorStore({"intro": [1.0, 0.0, 0.0], "copy": [1.0, 0.05, 0.0], "details": [0.7, 0.0, 0.7]})
+    question = np.array([1.0, 0.0, 0.3], dtype=np.float32)
+    results = retrieval.adaptive_search(store, None, "question", question / np.linalg.norm(question),
+                                        base_k=2, max_k=4, mmr_lambda=mmr_lambda)
+    return [doc.page_content for doc, _ in results]
+
+
+def test_depth_keeps_near_duplicate_without_mmr(retrieval):
+    assert search(retrieval, None) == ["intro", "copy"]
+
+
+@pytest.mark.parametrize("mmr_lambda", [0.5, 0.0])
+def test_mmr_replaces_near_duplicate(retrieval, mmr_lambda):
+    assert search(retrieval, mmr_lambda) == ["intro", "details"]
+
+
+def test_mmr_relevance_only_keeps_order(retrieval):
+    assert search(retrieval, 1.0) == ["intro", "copy"]